@@ -1,9 +1,18 @@
 import discord
 
+from typing import NamedTuple, Optional
 from discord.ext import commands
 from discord import app_commands
+from utils.cooldowns import cooldown
 from utils.database import CommunityRole, Guild
-from utils.utilities import gen_color
+from utils.utilities import PrefixTrie, gen_color
+from utils.views import CommunityRoleView
+
+
+class RoleEntry(NamedTuple):
+    id: int
+    alias: str
+    description: str
 
 
 @app_commands.guild_only
@@ -14,7 +23,9 @@ class Community(commands.GroupCog, name="communityrole"):
         super().__init__()
         self.bot = bot
         self.logger = self.bot.get_logger(self)
-        self.roles = {}
+        # Community roles of each guild by alias, and their aliases by prefix
+        self.roles: dict[int, dict[str, RoleEntry]] = {}
+        self.aliases: dict[int, PrefixTrie] = {}
         self.load_roles()
 
     @staticmethod
@@ -24,23 +35,65 @@ class Community(commands.GroupCog, name="communityrole"):
 
     def load_roles(self):
         self.roles = {}
-        self.roles = {guild.id: [] for guild in self.bot.s.query(Guild).all()}
-        for role in self.bot.s.query(CommunityRole).all():
-            self.roles[role.guild].append(role)
+        self.aliases = {}
+        for guild_id, role_id, alias, description in (
+            self.bot.s.query(
+                CommunityRole.guild,
+                CommunityRole.id,
+                CommunityRole.alias,
+                CommunityRole.description,
+            )
+            .execution_options(all_guilds=True)
+            .all()
+        ):
+            self.index_role(guild_id, RoleEntry(role_id, alias, description))
+
+    def index_role(self, guild_id: int, entry: RoleEntry):
+        self.roles.setdefault(guild_id, {})[entry.alias] = entry
+        self.aliases.setdefault(guild_id, PrefixTrie()).add(entry.alias)
+
+    def unindex_role(self, guild_id: int, alias: str):
+        self.roles.get(guild_id, {}).pop(alias, None)
+        if trie := self.aliases.get(guild_id):
+            trie.remove(alias)
+
+    def get_role(self, guild_id: int, alias: str) -> Optional[RoleEntry]:
+        return self.roles.get(guild_id, {}).get(alias)
 
-    @commands.cooldown(rate=1, per=20.0, type=commands.BucketType.member)
+    def search_roles(self, guild_id: int, prefix: str) -> list[RoleEntry]:
+        if not (trie := self.aliases.get(guild_id)):
+            return []
+        roles = self.roles[guild_id]
+        return [roles[alias] for alias in trie.search(prefix)]
+
+    async def giveme_autocomplete(
+        self, interaction: discord.Interaction, current: str
+    ) -> list[app_commands.Choice[str]]:
+        return [
+            app_commands.Choice(
+                name=f"{entry.alias} - {entry.description}"[:100], value=entry.alias
+            )
+            for entry in self.search_roles(interaction.guild.id, current)
+        ]
+
+    async def takeme_autocomplete(
+        self, interaction: discord.Interaction, current: str
+    ) -> list[app_commands.Choice[str]]:
+        return [
+            app_commands.Choice(
+                name=f"{entry.alias} - {entry.description}"[:100], value=entry.alias
+            )
+            for entry in self.search_roles(interaction.guild.id, current)
+            if interaction.user.get_role(entry.id)
+        ]
+
+    @cooldown(member=(1, 20.0))
     @app_commands.describe(role_name="Name of the community role")
     @app_commands.command()
+    @app_commands.autocomplete(role_name=giveme_autocomplete)
     async def giveme(self, interaction, role_name: str):
         """Gives a community role to yourself."""
-        if not (
-            entry := self.bot.s.query(CommunityRole)
-            .filter(
-                CommunityRole.alias == role_name,
-                CommunityRole.guild == interaction.guild.id,
-            )
-            .one_or_none()
-        ):
+        if not (entry := self.get_role(interaction.guild.id, role_name)):
             return await interaction.response.send_message(
                 "Check the community roles with `/community_roles list`",
                 ephemeral=True,
@@ -60,19 +113,13 @@ class Community(commands.GroupCog, name="communityrole"):
             f"You now have the {role.name} role!", ephemeral=True
         )
 
-    @commands.cooldown(rate=1, per=20.0, type=commands.BucketType.member)
+    @cooldown(member=(1, 20.0))
     @app_commands.describe(role_name="Name of the community role")
     @app_commands.command()
+    @app_commands.autocomplete(role_name=takeme_autocomplete)
     async def takeme(self, interaction, role_name: str):
         """Removes a community role from yourself"""
-        if not (
-            entry := self.bot.s.query(CommunityRole)
-            .filter(
-                CommunityRole.alias == role_name,
-                CommunityRole.guild == interaction.guild.id,
-            )
-            .one_or_none()
-        ):
+        if not (entry := self.get_role(interaction.guild.id, role_name)):
 
             return await interaction.response.send_message(
                 f"Check the community roles with {self.bot.command_prefix}cr list",
@@ -93,6 +140,28 @@ class Community(commands.GroupCog, name="communityrole"):
             "The role has been removed!", ephemeral=True
         )
 
+    @cooldown(member=(1, 20.0))
+    @app_commands.command()
+    async def pick(self, interaction: discord.Interaction):
+        """Picks several community roles at once"""
+        entries = sorted(
+            (
+                entry
+                for entry in self.roles.get(interaction.guild.id, {}).values()
+                if interaction.guild.get_role(entry.id)
+            ),
+            key=lambda entry: entry.alias.lower(),
+        )
+        if not entries:
+            return await interaction.response.send_message(
+                "There is no community roles.", ephemeral=True
+            )
+        await interaction.response.send_message(
+            "Pick your community roles, then save.",
+            view=CommunityRoleView(entries, interaction.user),
+            ephemeral=True,
+        )
+
     @staticmethod
     def can_be_community_role(role: discord.Role, top_role_pos: int):
         permissions = role.permissions
@@ -133,15 +202,10 @@ class Community(commands.GroupCog, name="communityrole"):
             )
 
         top_role = interaction.guild.me.top_role
-        if (
-            self.bot.s.query(CommunityRole)
-            .filter(
-                CommunityRole.alias == alias,
-                CommunityRole.guild == interaction.guild.id,
+        if self.get_role(interaction.guild.id, alias):
+            return await interaction.response.send_message(
+                "This alias is already in use."
             )
-            .one_or_none()
-        ):
-            await interaction.response.send_message("This alias is already in use.")
         elif self.bot.s.get(CommunityRole, (role.id, interaction.guild.id)):
             return await interaction.response.send_message(
                 "This role is a community role already."
@@ -160,7 +224,7 @@ class Community(commands.GroupCog, name="communityrole"):
             )
         )
         self.bot.s.commit()
-        self.load_roles()
+        self.index_role(interaction.guild.id, RoleEntry(role.id, alias, description))
         await interaction.response.send_message("Added community role succesfully.")
 
     @app_commands.checks.has_permissions(manage_channels=True)
@@ -174,22 +238,23 @@ class Community(commands.GroupCog, name="communityrole"):
             return await interaction.response.send_message(
                 "This role is not a community role."
             )
+        alias = entry.alias
         self.bot.s.delete(entry)
         self.bot.s.commit()
-        self.load_roles()
+        self.unindex_role(interaction.guild.id, alias)
         await interaction.response.send_message("Role removed succesfully.")
 
     @app_commands.command()
     async def list(self, interaction):
         """List the community roles"""
-        if not self.roles[interaction.guild.id]:
+        if not (roles := self.roles.get(interaction.guild.id)):
             return await interaction.response.send_message(
                 "There is no community roles."
             )
         embed = discord.Embed(
             title="Community roles", colour=gen_color(interaction.user.id)
         )
-        for role in self.roles[interaction.guild.id]:
+        for role in roles.values():
             embed.add_field(name=role.alias, value=role.description)
         await interaction.response.send_message(embed=embed)
 
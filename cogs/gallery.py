@@ -2,29 +2,56 @@ from __future__ import annotations
 
 import aiohttp
 import asyncio
+import csv
 import datetime
 import discord
+import io
+import json
+import os
+import random
+import re
+import tempfile
 
 from discord import ButtonStyle, app_commands
-from discord.ext import commands
-from sqlalchemy.orm import contains_eager
-from typing import TYPE_CHECKING, Optional
+from discord.ext import commands, tasks
+from sqlalchemy import and_, func, or_, text
+from typing import TYPE_CHECKING, Literal, Optional
+from utils.archive import export_gallery, import_gallery
 from utils.checks import not_blacklisted
-from utils.database import Art, Artist, BlackList, Guild
-from utils.utilities import DateTransformer, gen_color
+from utils.database import Art, Artist, ArtistActivity, BlackList, Guild
+from utils.media import HashIndex, ImageInfo, MediaStore
+from utils.partitions import use_guild
+from utils.queries import art_in_guild, artist_by_member
+from utils.stats import refresh_gallery_stats
+from utils.utilities import (
+    CDN_HOSTS,
+    DateTransformer,
+    gen_color,
+    RandomPool,
+    is_cdn_url,
+    parse_cdn_expiry,
+    refresh_cdn_urls,
+)
 
 if TYPE_CHECKING:
     from main import Mayushii
 
+FETCH_TIMEOUT = aiohttp.ClientTimeout(total=30)
+
 
 class GalleryView(discord.ui.View):
     def __init__(
-        self, interaction: discord.Interaction, artist: Artist, member: discord.Member
+        self,
+        interaction: discord.Interaction,
+        artist: Artist,
+        member: discord.Member,
+        media: Optional[MediaStore] = None,
     ):
         super().__init__(timeout=20)
         self.inter = interaction
         self.artist = artist
         self.artist_user = member
+        self.media = media
         self.current = 0
         self.n_pages = len(artist.gallery)
         self.message: Optional[discord.Message] = None
@@ -36,15 +63,25 @@ class GalleryView(discord.ui.View):
         if self.message:
             await self.message.edit(view=None)
 
-    def create_embed(self):
+    def create_page(self) -> tuple[discord.Embed, list[discord.File]]:
         embed = discord.Embed(color=discord.Color.dark_red())
+        files = []
         art = self.artist.gallery[self.current]
         embed.set_author(
             name=f"{self.artist_user.display_name}'s Gallery {self.current + 1}",
             icon_url=self.artist_user.avatar.url if self.artist_user.avatar else None,
         )
         footer = f"Art id: {art.id}"
-        if art.link.lower().endswith((".gif", ".png", ".jpeg", "jpg")):
+        if (
+            self.media
+            and art.hash
+            and (thumbnail := self.media.thumbnail_path(art.hash)).exists()
+        ):
+            files.append(discord.File(thumbnail, filename=thumbnail.name))
+            embed.set_image(url=f"attachment://{thumbnail.name}")
+            if art.description:
+                footer += f"\n{art.description}"
+        elif art.link.lower().endswith((".gif", ".png", ".jpeg", "jpg")):
             embed.set_image(url=art.link)
             if art.description:
                 footer += f"\n{art.description}"
@@ -52,35 +89,104 @@ class GalleryView(discord.ui.View):
             embed.description = f"{art.description}\n{art.link}"
         footer += f"\n{self.current + 1}/{self.n_pages}"
         embed.set_footer(text=footer)
-        return embed
+        return embed, files
+
+    async def show_page(self, interaction: discord.Interaction):
+        embed, files = self.create_page()
+        await interaction.response.edit_message(embed=embed, attachments=files)
 
     @discord.ui.button(label="<<", style=ButtonStyle.secondary, disabled=True)
     async def first_page(
         self, interaction: discord.Interaction, button: discord.ui.Button
     ):
         self.current = 0
-        await interaction.response.edit_message(embed=self.create_embed())
+        await self.show_page(interaction)
 
     @discord.ui.button(label="Back", style=ButtonStyle.primary, disabled=True)
     async def prev_page(
         self, interaction: discord.Interaction, button: discord.ui.Button
     ):
         self.current = (self.current - 1) % self.n_pages
-        await interaction.response.edit_message(embed=self.create_embed())
+        await self.show_page(interaction)
 
     @discord.ui.button(label="Next", style=ButtonStyle.primary)
     async def next_page(
         self, interaction: discord.Interaction, button: discord.ui.Button
     ):
         self.current = (self.current + 1) % self.n_pages
-        await interaction.response.edit_message(embed=self.create_embed())
+        await self.show_page(interaction)
 
     @discord.ui.button(label=">>", style=ButtonStyle.secondary)
     async def last_page(
         self, interaction: discord.Interaction, button: discord.ui.Button
     ):
         self.current = self.n_pages - 1
-        await interaction.response.edit_message(embed=self.create_embed())
+        await self.show_page(interaction)
+
+
+class SearchView(discord.ui.View):
+    page_size = 10
+
+    def __init__(
+        self,
+        interaction: discord.Interaction,
+        cog: Gallery,
+        query: str,
+        member: Optional[discord.Member] = None,
+    ):
+        super().__init__(timeout=60)
+        self.inter = interaction
+        self.cog = cog
+        self.query = query
+        self.member = member
+        self.page = 0
+        self.results = []
+        self.load_page()
+
+    async def on_timeout(self):
+        await self.inter.edit_original_response(view=None)
+
+    def load_page(self):
+        assert self.inter.guild is not None
+        rows = self.cog.search_art(
+            self.inter.guild.id,
+            self.query,
+            member_id=self.member.id if self.member else None,
+            limit=self.page_size + 1,
+            offset=self.page * self.page_size,
+        )
+        self.results = rows[: self.page_size]
+        self.prev_page.disabled = self.page == 0
+        self.next_page.disabled = len(rows) <= self.page_size
+
+    def create_embed(self):
+        embed = discord.Embed(
+            title=f"Art matching {self.query}", color=discord.Color.dark_red()
+        )
+        for art_id, link, description, userid in self.results:
+            embed.add_field(
+                name=f"Art id: {art_id}",
+                value=f"<@{userid}> {description[:200]}\n{link}",
+                inline=False,
+            )
+        embed.set_footer(text=f"Page {self.page + 1}")
+        return embed
+
+    @discord.ui.button(label="Back", style=ButtonStyle.primary)
+    async def prev_page(
+        self, interaction: discord.Interaction, button: discord.ui.Button
+    ):
+        self.page -= 1
+        self.load_page()
+        await interaction.response.edit_message(embed=self.create_embed(), view=self)
+
+    @discord.ui.button(label="Next", style=ButtonStyle.primary)
+    async def next_page(
+        self, interaction: discord.Interaction, button: discord.ui.Button
+    ):
+        self.page += 1
+        self.load_page()
+        await interaction.response.edit_message(embed=self.create_embed(), view=self)
 
 
 class Gallery(commands.Cog):
@@ -90,22 +196,337 @@ class Gallery(commands.Cog):
         self.bot: Mayushii = bot
         self.logger = self.bot.get_logger(self)
         self.in_cleanup = False
+        self.jobs: set[asyncio.Task] = set()
         self.art_channels: dict[int, int] = {
-            guild.id: guild.art_channel for guild in self.bot.s.query(Guild).all()
+            guild.id: guild.art_channel
+            for guild in self.bot.s.query(Guild)
+            .execution_options(all_guilds=True)
+            .all()
         }
+        # channel id -> guild id of the art channels of guilds with the cog enabled
+        self.routes: dict[int, int] = {}
+        self.update_routes()
+        self.media: Optional[MediaStore] = None
+        if media_dir := self.bot.config.get("media_dir"):
+            self.media = MediaStore(
+                media_dir, thumbnail_size=self.bot.config.get("thumbnail_size", 512)
+            )
+        self.duplicate_distance: int = self.bot.config.get("duplicate_distance", 6)
+        self.max_image_size: int = self.bot.config.get("max_image_size", 10 * 2**20)
+        self.duplicates: dict[int, HashIndex] = {}
+        self.pool: dict[int, RandomPool] = {}
+        self.rng = random.Random()
+        self.load_indexes()
+
+    async def cog_load(self):
+        self.refresh_links_loop.start()
+        self.refresh_stats_loop.start()
+        self.spotlight_loop.start()
+
+    async def cog_unload(self):
+        self.refresh_links_loop.cancel()
+        self.refresh_stats_loop.cancel()
+        self.spotlight_loop.cancel()
+        if self.media:
+            self.media.close()
+
+    def update_routes(self):
+        """Rebuilds the art channel routes used by on_message"""
+        self.routes = {
+            guild.art_channel: guild.id
+            for guild in self.bot.s.query(Guild)
+            .execution_options(all_guilds=True)
+            .all()
+            if guild.art_channel and guild.flags & 0b10
+        }
+
+    def load_indexes(self):
+        """Builds the per guild random art pools and perceptual hash indexes"""
+        self.duplicates = {}
+        self.pool = {}
+        rows = (
+            self.bot.s.query(Art.id, Art.phash, Artist.guild)
+            .join(Art.artist)
+            .execution_options(all_guilds=True)
+            .all()
+        )
+        for art_id, phash, guild_id in rows:
+            self.index_art(guild_id, art_id, phash)
+
+    def index_art(self, guild_id: int, art_id: int, phash: Optional[str]):
+        self.pool.setdefault(guild_id, RandomPool()).add(art_id)
+        if phash:
+            self.duplicates.setdefault(guild_id, HashIndex()).add(
+                int(phash, 16), art_id
+            )
+
+    def unindex_art(self, guild_id: int, art: Art):
+        if pool := self.pool.get(guild_id):
+            pool.remove(art.id)
+        if art.phash and (tree := self.duplicates.get(guild_id)):
+            tree.remove(int(art.phash, 16), art.id)
+
+    def random_art(
+        self, guild_id: int, member: Optional[discord.Member] = None
+    ) -> Optional[Art]:
+        """Picks art uniformly at random from a guild or a member gallery"""
+        if member is None:
+            if (pool := self.pool.get(guild_id)) and (art_id := pool.choice()):
+                return self.bot.s.get(Art, art_id)
+            return None
+        if not (artist := self.get_artist(member)) or not artist.art_count:
+            return None
+        return (
+            self.bot.s.query(Art)
+            .filter(Art.artist_id == artist.id)
+            .order_by(Art.id)
+            .offset(self.rng.randrange(artist.art_count))
+            .limit(1)
+            .first()
+        )
 
-    def is_enabled(self, guild: discord.Guild):
-        dbguild = self.bot.s.get(Guild, guild.id)
-        return dbguild.flags & 0b10
+    def create_art_embed(
+        self, art: Art, title: str
+    ) -> tuple[discord.Embed, list[discord.File]]:
+        embed = discord.Embed(title=title, color=gen_color(art.artist.userid))
+        files = []
+        footer = f"Art id: {art.id}"
+        if (
+            self.media
+            and art.hash
+            and (thumbnail := self.media.thumbnail_path(art.hash)).exists()
+        ):
+            files.append(discord.File(thumbnail, filename=thumbnail.name))
+            embed.set_image(url=f"attachment://{thumbnail.name}")
+            embed.description = f"By <@{art.artist.userid}>"
+        elif art.link.lower().endswith((".gif", ".png", ".jpeg", "jpg")):
+            embed.set_image(url=art.link)
+            embed.description = f"By <@{art.artist.userid}>"
+        else:
+            embed.description = f"By <@{art.artist.userid}>\n{art.link}"
+        if art.description:
+            footer += f"\n{art.description}"
+        embed.set_footer(text=footer)
+        return embed, files
+
+    def find_duplicates(self, guild_id: int, phash: int) -> list[int]:
+        """Returns the ids of art that looks like the image with the given hash"""
+        if not (tree := self.duplicates.get(guild_id)):
+            return []
+        return [art_id for _, art_id in tree.search(phash, self.duplicate_distance)]
+
+    @staticmethod
+    def match_expression(
+        query: str, guild_id: int, member_id: Optional[int] = None, prefix=False
+    ) -> Optional[str]:
+        """Builds a FTS5 query matching all the words of query in a guild"""
+        if not (words := re.findall(r"\w+", query)):
+            return None
+        terms = " ".join(f'"{word}"' for word in words)
+        if prefix:
+            terms += "*"
+        expression = f'guild : "{guild_id}" AND description : ({terms})'
+        if member_id is not None:
+            expression += f' AND userid : "{member_id}"'
+        return expression
+
+    def search_art(
+        self,
+        guild_id: int,
+        query: str,
+        member_id: Optional[int] = None,
+        limit: int = 10,
+        offset: int = 0,
+        prefix=False,
+    ):
+        """Returns (id, link, description, userid) of the matching art by rank"""
+        if self.bot.engine_for(guild_id).dialect.name != "sqlite":
+            return self.search_art_like(guild_id, query, member_id, limit, offset)
+        if not (
+            expression := self.match_expression(query, guild_id, member_id, prefix)
+        ):
+            return []
+        return self.bot.s.execute(
+            text(
+                "SELECT gallery.id, gallery.link, gallery.description, art_search.userid "
+                "FROM art_search JOIN gallery ON gallery.id = art_search.rowid "
+                "WHERE art_search MATCH :expression ORDER BY rank "
+                "LIMIT :limit OFFSET :offset"
+            ),
+            {"expression": expression, "limit": limit, "offset": offset},
+            bind_arguments={"shard_id": guild_id},
+        ).all()
+
+    def search_art_like(
+        self,
+        guild_id: int,
+        query: str,
+        member_id: Optional[int] = None,
+        limit: int = 10,
+        offset: int = 0,
+    ):
+        """Fallback of search_art for databases without FTS5, newest first"""
+        if not (words := re.findall(r"\w+", query)):
+            return []
+        search = (
+            self.bot.s.query(Art.id, Art.link, Art.description, Artist.userid)
+            .join(Art.artist)
+            .filter(
+                Artist.guild == guild_id,
+                *(
+                    Art.description.ilike(
+                        "%" + word.replace("_", r"\_") + "%", escape="\\"
+                    )
+                    for word in words
+                ),
+            )
+        )
+        if member_id is not None:
+            search = search.filter(Artist.userid == member_id)
+        return search.order_by(Art.id.desc()).limit(limit).offset(offset).all()
 
     async def no_cleanup(self):
         while self.in_cleanup:
-            pass
+            await asyncio.sleep(1)
+
+    async def refresh_links(self, guild_id: Optional[int] = None) -> int:
+        """Refreshes the CDN links that expired or are about to"""
+        soon = datetime.datetime.now(datetime.UTC) + datetime.timedelta(hours=1)
+        query = self.bot.s.query(Art).filter(
+            Art.link_refreshable.isnot(False),
+            or_(
+                Art.link_expires < soon,
+                # Links stored before expiry tracking or before links were signed
+                and_(
+                    Art.link_expires.is_(None),
+                    or_(*(Art.link.like(f"https://{host}/%") for host in CDN_HOSTS)),
+                ),
+            ),
+        )
+        if guild_id is not None:
+            query = query.join(Art.artist).filter(Artist.guild == guild_id)
+        refreshed = 0
+        last_id = 0
+        while arts := query.filter(Art.id > last_id).order_by(Art.id).limit(50).all():
+            last_id = arts[-1].id
+            try:
+                urls = await refresh_cdn_urls(self.bot.http, [art.link for art in arts])
+            except discord.HTTPException as e:
+                self.logger.error(f"Failed to refresh links: {e}")
+                break
+            for art in arts:
+                if (url := urls.get(art.link)) and url != art.link:
+                    art.link = url
+                    art.link_expires = parse_cdn_expiry(url)
+                    refreshed += 1
+                # Links Discord can't refresh, or gave no expiry for, would
+                # be sent again every hour, the cleanup checks them instead
+                if not url or art.link_expires is None:
+                    art.link_refreshable = False
+            self.bot.s.commit()
+        if refreshed:
+            self.logger.info(f"Refreshed {refreshed} art links")
+        return refreshed
+
+    def start_job(self, coro):
+        task = asyncio.create_task(coro)
+        self.jobs.add(task)
+        task.add_done_callback(self.jobs.discard)
+
+    async def export_job(self, interaction: discord.Interaction):
+        assert interaction.guild is not None
+        fd, path = tempfile.mkstemp(suffix=".ndjson.gz")
+        os.close(fd)
+        try:
+            artists, arts = await asyncio.to_thread(
+                export_gallery,
+                self.bot.reader_for(interaction.guild.id),
+                interaction.guild.id,
+                path,
+            )
+            await interaction.followup.send(
+                f"Exported {arts} art from {artists} artists.",
+                file=discord.File(
+                    path, filename=f"gallery_{interaction.guild.id}.ndjson.gz"
+                ),
+                ephemeral=True,
+            )
+        except Exception as e:
+            self.logger.error(f"Failed to export galleries: {type(e)}:{e}")
+            await interaction.followup.send(
+                "Failed to export galleries.", ephemeral=True
+            )
+        finally:
+            os.remove(path)
+
+    async def import_job(
+        self, interaction: discord.Interaction, archive: discord.Attachment
+    ):
+        assert interaction.guild is not None
+        fd, path = tempfile.mkstemp(suffix=".ndjson.gz")
+        os.close(fd)
+        try:
+            await archive.save(path)
+            result = await asyncio.to_thread(
+                import_gallery,
+                self.bot.engine_for(interaction.guild.id),
+                interaction.guild.id,
+                path,
+            )
+            for art_id, phash in result.new_art:
+                self.index_art(interaction.guild.id, art_id, phash)
+            await asyncio.to_thread(
+                refresh_gallery_stats,
+                self.bot.engine_for(interaction.guild.id),
+                interaction.guild.id,
+            )
+            msg = f"Imported {result.arts} art and {result.artists} new artists."
+            if result.duplicates:
+                msg += f" Skipped {result.duplicates} art already in the gallery."
+            await interaction.followup.send(msg, ephemeral=True)
+        except Exception as e:
+            self.logger.error(f"Failed to import galleries: {type(e)}:{e}")
+            await interaction.followup.send(
+                "Failed to import galleries.", ephemeral=True
+            )
+        finally:
+            os.remove(path)
+
+    @tasks.loop(time=datetime.time(hour=12, tzinfo=datetime.timezone.utc))
+    async def spotlight_loop(self):
+        for dbguild in (
+            self.bot.s.query(Guild)
+            .filter(Guild.spotlight_channel.isnot(None))
+            .execution_options(all_guilds=True)
+            .all()
+        ):
+            use_guild(dbguild.id)
+            if not dbguild.flags & 0b10 or not (art := self.random_art(dbguild.id)):
+                continue
+            channel = self.bot.get_channel(dbguild.spotlight_channel)
+            if not isinstance(channel, discord.TextChannel):
+                continue
+            embed, files = self.create_art_embed(art, "Art of the day")
+            try:
+                await channel.send(embed=embed, files=files)
+            except discord.HTTPException as e:
+                self.logger.error(f"Failed to post art of the day: {e}")
+
+    @tasks.loop(hours=1)
+    async def refresh_stats_loop(self):
+        for engine in self.bot.engines():
+            await asyncio.to_thread(refresh_gallery_stats, engine)
+
+    @tasks.loop(hours=1)
+    async def refresh_links_loop(self):
+        await self.refresh_links()
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
-        if message.guild is None:
+        # Most messages are not in an art channel, drop them before anything else
+        if message.channel.id not in self.routes:
             return
+        use_guild(self.routes[message.channel.id])
 
         if (
             message.author.id == self.bot.user.id
@@ -114,23 +535,42 @@ class Gallery(commands.Cog):
         ):
             return
 
-        art_channel_id = self.art_channels.get(message.guild.id)
-        if not self.is_enabled(message.guild) or art_channel_id is None:
-            return
-        if message.channel.id == art_channel_id:
-            count = 0
-            added = []
-            for attachment in message.attachments:
-                if attachment.height and not message.content.startswith("."):
-                    art_id = await self.add_art(
-                        message.author, attachment.url, message.content
-                    )
-                    added.append(art_id)
-                    count += 1
-            if count:
-                await message.channel.send(
-                    f"Added {count} image(s) to {message.author}'s gallery with id(s) {', '.join(map(str, added))}!"
+        count = 0
+        added = []
+        flagged = []
+        for attachment in message.attachments:
+            if attachment.height and not message.content.startswith("."):
+                image = None
+                if self.media:
+                    try:
+                        image = await self.store_image(await attachment.read())
+                    except discord.HTTPException as e:
+                        self.logger.error(
+                            f"Failed to download {attachment.url}: {type(e)}:{e}"
+                        )
+                art_id, matches = await self.add_art(
+                    message.author,
+                    attachment.url,
+                    message.content,
+                    image,
+                    message=message,
+                    attachment=attachment,
                 )
+                if matches:
+                    flagged.append(
+                        f"{attachment.filename} looks like id(s) {', '.join(map(str, matches))}"
+                    )
+                if art_id is None:
+                    continue
+                added.append(art_id)
+                count += 1
+        msg = ""
+        if count:
+            msg += f"Added {count} image(s) to {message.author}'s gallery with id(s) {', '.join(map(str, added))}!"
+        if flagged:
+            msg += f"\nPossible duplicate(s): {'; '.join(flagged)}"
+        if msg:
+            await message.channel.send(msg.strip())
 
     def add_artist(self, member: discord.Member):
         artist = Artist(userid=member.id, guild=member.guild.id)
@@ -138,32 +578,120 @@ class Gallery(commands.Cog):
         self.logger.debug(f"Added artist {member.id} in guild {member.guild.id}")
         return artist
 
-    async def add_art(self, member: discord.Member, url, description=""):
+    async def store_image(self, data: bytes) -> Optional[ImageInfo]:
+        assert self.media is not None
+        try:
+            return await self.media.store(data)
+        except Exception as e:
+            self.logger.error(f"Failed to store image: {type(e)}:{e}")
+            return None
+
+    async def fetch_image(self, url: str) -> Optional[bytes]:
+        """Downloads an image from the Discord CDN, None if it isn't on the CDN,
+        fails or is larger than max_image_size"""
+        if not is_cdn_url(url):
+            return None
+        try:
+            async with self.bot.session.get(
+                url, timeout=FETCH_TIMEOUT, allow_redirects=False
+            ) as r:
+                if r.status != 200:
+                    return None
+                if r.content_length and r.content_length > self.max_image_size:
+                    return None
+                data = bytearray()
+                async for chunk in r.content.iter_chunked(64 * 1024):
+                    data += chunk
+                    if len(data) > self.max_image_size:
+                        return None
+                return bytes(data)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.logger.error(f"Failed to fetch image {url}: {type(e)}:{e}")
+        return None
+
+    async def add_art(
+        self,
+        member: discord.Member,
+        url,
+        description="",
+        image: Optional[ImageInfo] = None,
+        message: Optional[discord.Message] = None,
+        attachment: Optional[discord.Attachment] = None,
+    ) -> tuple[Optional[int], list[int]]:
+        """Adds art to the gallery of member.
+
+        Returns the id of the new art, None if it wasn't added, and the ids of
+        existing art it looks like. Lookalikes are only found for stored images
+        and aren't added if skip_duplicates is set.
+        """
         await asyncio.wait_for(self.no_cleanup(), timeout=None)
         if self.bot.s.get(BlackList, (member.id, member.guild.id)):
-            return
+            return None, []
+        matches = self.find_duplicates(member.guild.id, image.phash) if image else []
+        if matches and self.bot.config.get("skip_duplicates"):
+            return None, matches
         if not (artist := self.get_artist(member)):
             artist = self.add_artist(member)
             self.bot.s.commit()
             self.bot.s.refresh(artist)
 
-        art = Art(artist_id=artist.id, link=url, description=description)
+        created_at = message.created_at if message else discord.utils.utcnow()
+        art = Art(
+            artist_id=artist.id,
+            link=url,
+            description=description,
+            created_at=created_at,
+            link_expires=parse_cdn_expiry(url),
+        )
+        if message and attachment:
+            art.channel_id = message.channel.id
+            art.message_id = message.id
+            art.attachment_id = attachment.id
+        if image:
+            art.hash, art.size, art.width, art.height, phash = image
+            art.phash = f"{phash:016x}"
         self.bot.s.add(art)
+        artist.art_count = (artist.art_count or 0) + 1
+        artist.first_upload = artist.first_upload or created_at
+        artist.last_upload = created_at
+        self.count_activity(artist.id, created_at, 1)
         self.bot.s.commit()
         self.bot.s.refresh(art)
+        self.index_art(member.guild.id, art.id, art.phash)
         self.logger.debug(f"Added art with id {art.id} in guild {art.artist.guild}")
-        return art.id
+        return art.id, matches
 
     def get_artist(self, member: discord.Member):
-        return (
-            self.bot.s.query(Artist)
-            .filter(Artist.userid == member.id, Artist.guild == member.guild.id)
-            .one_or_none()
+        return self.bot.s.scalars(
+            artist_by_member, {"userid": member.id, "guild": member.guild.id}
+        ).one_or_none()
+
+    def count_activity(self, artist_id: int, date: datetime.datetime, n: int):
+        month = date.strftime("%Y-%m")
+        if not (activity := self.bot.s.get(ArtistActivity, (artist_id, month))):
+            activity = ArtistActivity(artist_id=artist_id, month=month, count=0)
+            self.bot.s.add(activity)
+        activity.count += n
+
+    def update_artist_stats(self, artist: Artist):
+        """Recomputes the counters of an artist after removing art"""
+        self.bot.s.flush()
+        artist.art_count, artist.first_upload, artist.last_upload = (
+            self.bot.s.query(
+                func.count(Art.id), func.min(Art.created_at), func.max(Art.created_at)
+            )
+            .filter(Art.artist_id == artist.id)
+            .one()
         )
 
-    def delete_art(self, art_id):
-        self.bot.s.query(Art).filter_by(id=art_id).delete()
-        self.logger.debug(f"Deleted art with id {art_id}")
+    def delete_art(self, art: Art):
+        artist = art.artist
+        self.unindex_art(artist.guild, art)
+        if art.created_at:
+            self.count_activity(artist.id, art.created_at, -1)
+        self.bot.s.delete(art)
+        self.update_artist_stats(artist)
+        self.logger.debug(f"Deleted art with id {art.id}")
         self.bot.s.commit()
 
     art = app_commands.Group(name="art", description="Commands for managing art")
@@ -185,7 +713,23 @@ class Gallery(commands.Cog):
                 "Add a description for non image entries!", ephemeral=True
             )
         else:
-            art_id = await self.add_art(interaction.user, link, description)
+            image = None
+            if self.media and is_image:
+                await interaction.response.defer()
+                if data := await self.fetch_image(link):
+                    image = await self.store_image(data)
+            art_id, matches = await self.add_art(
+                interaction.user, link, description, image
+            )
+            duplicates = ", ".join(map(str, matches))
+            if art_id is None:
+                msg = "Art not added"
+                if matches:
+                    msg += f", it looks like id(s) {duplicates}"
+                if interaction.response.is_done():
+                    return await interaction.followup.send(f"{msg}.")
+                return await interaction.response.send_message(f"{msg}.")
+            content = f"Possible duplicate of id(s) {duplicates}" if matches else None
             embed = discord.Embed(color=gen_color(interaction.user.id))
             embed.set_author(
                 name=f"{interaction.user.display_name}",
@@ -203,23 +747,19 @@ class Gallery(commands.Cog):
                 embed.description = f"{description}\n{link}"
             footer += f"\nArt id: {art_id}"
             embed.set_footer(text=footer)
-            await interaction.response.send_message(embed=embed)
+            if interaction.response.is_done():
+                await interaction.followup.send(content, embed=embed)
+            else:
+                await interaction.response.send_message(content, embed=embed)
 
     @app_commands.describe(art_id="ID of the art to delete")
     @art.command(name="delete")
     async def art_delete(self, interaction, art_id: int):
         """Removes image from user gallery"""
         deleted = []
-        art = (
-            self.bot.s.query(Art)
-            .join(Artist)
-            .filter(
-                Art.id == art_id,
-                Art.artist_id == Artist.id,
-                Artist.guild == interaction.guild.id,
-            )
-            .one_or_none()
-        )
+        art = self.bot.s.scalars(
+            art_in_guild, {"art_id": art_id, "guild": interaction.guild.id}
+        ).one_or_none()
         if art is None:
             await interaction.response.send_message(f"ID {art_id} not found")
             return
@@ -231,7 +771,7 @@ class Gallery(commands.Cog):
         ):
             await interaction.response.send_message("You cant delete other people art!")
             return
-        self.delete_art(art_id)
+        self.delete_art(art)
         deleted.append(str(art_id))
         if deleted:
             await interaction.response.send_message(
@@ -244,49 +784,90 @@ class Gallery(commands.Cog):
         """Cleans up the galleries of invalid links"""
         todelete = []
         self.in_cleanup = True
+        try:
+            await interaction.response.send_message(
+                "Starting gallery cleanup (This might take a while)!"
+            )
+            await self.bot.change_presence(status=discord.Status.dnd)
+            # Expired links are still valid art, get fresh ones before checking
+            await self.refresh_links(interaction.guild.id)
+            with self.bot.read_session(interaction.guild.id) as s:
+                arts = (
+                    s.query(Art.id, Art.link, Art.hash)
+                    .join(Art.artist)
+                    .filter(Artist.guild == interaction.guild.id)
+                    .all()
+                )
+            tasks = []
+
+            async def head(url: str, s: aiohttp.ClientSession):
+                try:
+                    async with s.head(url) as r:
+                        return r.status != 400
+                except aiohttp.InvalidURL:
+                    return False
+                except Exception as e:
+                    self.logger.error(f"Unknown exception in clean up: {type(e)}:{e}")
+                    return True
+
+            # Art kept in the media store doesn't depend on the remote link
+            if self.media:
+                arts = [
+                    art for art in arts if not (art.hash and self.media.has(art.hash))
+                ]
+
+            for art in arts:
+                task = asyncio.ensure_future(head(art.link, self.bot.session))
+                tasks.append(task)
+            responses = await asyncio.gather(*tasks)
+
+            for n, ok in enumerate(responses):
+                if not ok and (art := self.bot.s.get(Art, arts[n].id)) is not None:
+                    todelete.append(art)
+
+            if todelete:
+                for art in todelete:
+                    self.unindex_art(interaction.guild.id, art)
+                    if art.created_at:
+                        self.count_activity(art.artist_id, art.created_at, -1)
+                    self.bot.s.delete(art)
+                for artist in {art.artist for art in todelete}:
+                    self.update_artist_stats(artist)
+                self.bot.s.commit()
+                await interaction.edit_original_response(
+                    content=f"Deleted {len(todelete)} invalid images!"
+                )
+            else:
+                await interaction.edit_original_response(
+                    content="No invalid images found!"
+                )
+        finally:
+            # add_art waits for this, it must be cleared whatever happens
+            self.in_cleanup = False
+            await self.bot.change_presence(status=discord.Status.online)
+
+    @app_commands.checks.has_permissions(manage_guild=True)
+    @art.command()
+    async def export(self, interaction: discord.Interaction):
+        """Exports the server galleries to a file"""
         await interaction.response.send_message(
-            "Starting gallery cleanup (This might take a while)!"
-        )
-        await self.bot.change_presence(status=discord.Status.dnd)
-        arts: list[Art] = (
-            self.bot.s.query(Art)
-            .join(Art.artist)
-            .filter(Artist.guild == interaction.guild.id)
-            .options(contains_eager(Art.artist))
-            .all()
+            "Exporting the galleries, the file will be sent here when it's ready.",
+            ephemeral=True,
         )
-        tasks = []
+        self.start_job(self.export_job(interaction))
 
-        async def head(url: str, s: aiohttp.ClientSession):
-            try:
-                async with s.head(url) as r:
-                    return r.status != 400
-            except aiohttp.InvalidURL:
-                return False
-            except Exception as e:
-                self.logger.error(f"Unknown exception in clean up: {type(e)}:{e}")
-                return True
-
-        for art in arts:
-            task = asyncio.ensure_future(head(art.link, self.bot.session))
-            tasks.append(task)
-        responses = await asyncio.gather(*tasks)
-
-        for n, ok in enumerate(responses):
-            if not ok:
-                todelete.append(arts[n])
-
-        if todelete:
-            for art in todelete:
-                self.bot.s.delete(art)
-            self.bot.s.commit()
-            await interaction.edit_original_response(
-                content=f"Deleted {len(todelete)} invalid images!"
-            )
-        else:
-            await interaction.edit_original_response(content="No invalid images found!")
-        self.in_cleanup = False
-        await self.bot.change_presence(status=discord.Status.online)
+    @app_commands.checks.has_permissions(manage_guild=True)
+    @app_commands.describe(archive="File made by /art export")
+    @art.command(name="import")
+    async def art_import(
+        self, interaction: discord.Interaction, archive: discord.Attachment
+    ):
+        """Imports galleries from a file made by /art export"""
+        await interaction.response.send_message(
+            "Importing the galleries, you will be notified when it's done.",
+            ephemeral=True,
+        )
+        self.start_job(self.import_job(interaction, archive))
 
     @app_commands.checks.has_permissions(manage_guild=True)
     @app_commands.describe(channel="Text channel to set as the art channel")
@@ -297,6 +878,7 @@ class Gallery(commands.Cog):
         dbguild.art_channel = channel.id
         self.art_channels[interaction.guild.id] = channel.id
         self.bot.s.commit()
+        self.update_routes()
         await interaction.response.send_message(f"Set art channel to {channel.mention}")
 
     @app_commands.describe(member="Member to check the gallery of")
@@ -305,15 +887,179 @@ class Gallery(commands.Cog):
         """Show a user gallery"""
         artist = self.get_artist(member)
         if artist and artist.gallery:
-            view = GalleryView(interaction, artist, member)
+            view = GalleryView(interaction, artist, member, self.media)
+            embed, files = view.create_page()
             view.message = await interaction.response.send_message(
-                embed=view.create_embed(), view=view, ephemeral=True
+                embed=embed, files=files, view=view, ephemeral=True
             )
         else:
             await interaction.response.send_message(
                 "This user doesnt have a gallery", ephemeral=True
             )
 
+    @app_commands.describe(
+        query="Words to look for in the art descriptions",
+        member="Only search the gallery of this member",
+    )
+    @art.command()
+    async def search(
+        self,
+        interaction: discord.Interaction,
+        query: str,
+        member: Optional[discord.Member] = None,
+    ):
+        """Searches the art descriptions"""
+        view = SearchView(interaction, self, query, member)
+        if not view.results:
+            return await interaction.response.send_message(
+                "No art found.", ephemeral=True
+            )
+        await interaction.response.send_message(
+            embed=view.create_embed(), view=view, ephemeral=True
+        )
+
+    @search.autocomplete("query")
+    async def search_autocomplete(
+        self, interaction: discord.Interaction, current: str
+    ) -> list[app_commands.Choice[str]]:
+        assert interaction.guild is not None
+        descriptions = {
+            description[:100]
+            for _, _, description, _ in self.search_art(
+                interaction.guild.id, current, limit=25, prefix=True
+            )
+            if description
+        }
+        return [app_commands.Choice(name=d, value=d) for d in descriptions]
+
+    @app_commands.checks.has_permissions(manage_nicknames=True)
+    @art.command()
+    async def duplicates(self, interaction: discord.Interaction):
+        """Lists art that looks like other art in the server"""
+        assert interaction.guild is not None
+        await interaction.response.defer(ephemeral=True)
+        pairs = []
+        if tree := self.duplicates.get(interaction.guild.id):
+            for n, (phash, art_id) in enumerate(list(tree)):
+                for distance, other in tree.search(phash, self.duplicate_distance):
+                    if other > art_id:
+                        pairs.append((distance, art_id, other))
+                if n % 1000 == 0:
+                    await asyncio.sleep(0)
+        if not pairs:
+            return await interaction.followup.send("No duplicates found.")
+        pairs.sort()
+        msg = ""
+        for n, (distance, art_id, other) in enumerate(pairs):
+            line = f"{art_id} and {other} (distance {distance})\n"
+            if len(msg) + len(line) > 1900:
+                msg += f"And {len(pairs) - n} more."
+                break
+            msg += line
+        await interaction.followup.send(msg)
+
+    @app_commands.describe(member="Only pick art from this member")
+    @art.command(name="random")
+    async def art_random(
+        self, interaction: discord.Interaction, member: Optional[discord.Member] = None
+    ):
+        """Shows a random piece of art"""
+        assert interaction.guild is not None
+        if not (art := self.random_art(interaction.guild.id, member)):
+            return await interaction.response.send_message(
+                "There is no art to show.", ephemeral=True
+            )
+        embed, files = self.create_art_embed(art, "Random art")
+        await interaction.response.send_message(embed=embed, files=files)
+
+    @app_commands.checks.has_permissions(manage_guild=True)
+    @app_commands.describe(
+        channel="Text channel to post the art of the day in. Leave empty to disable"
+    )
+    @art.command()
+    async def spotlight(
+        self,
+        interaction: discord.Interaction,
+        channel: Optional[discord.TextChannel] = None,
+    ):
+        """Sets the channel for the daily art of the day post"""
+        assert interaction.guild is not None
+        dbguild = self.bot.s.get(Guild, interaction.guild.id)
+        dbguild.spotlight_channel = channel.id if channel else None
+        self.bot.s.commit()
+        if channel:
+            await interaction.response.send_message(
+                f"Art of the day will be posted in {channel.mention}"
+            )
+        else:
+            await interaction.response.send_message("Art of the day disabled")
+
+    @app_commands.describe(count="Number of artists to show")
+    @art.command()
+    async def top(
+        self,
+        interaction: discord.Interaction,
+        count: app_commands.Range[int, 1, 25] = 10,
+    ):
+        """Shows the artists with the most art"""
+        assert interaction.guild is not None
+        with self.bot.read_session(interaction.guild.id) as s:
+            artists = (
+                s.query(Artist.userid, Artist.art_count)
+                .filter(Artist.guild == interaction.guild.id, Artist.art_count > 0)
+                .order_by(Artist.art_count.desc())
+                .limit(count)
+                .all()
+            )
+        if not artists:
+            return await interaction.response.send_message(
+                "There are no artists yet.", ephemeral=True
+            )
+        embed = discord.Embed(title="Top artists", color=discord.Color.dark_red())
+        embed.description = "\n".join(
+            f"{n}. <@{artist.userid}> - {artist.art_count} piece(s)"
+            for n, artist in enumerate(artists, start=1)
+        )
+        await interaction.response.send_message(embed=embed)
+
+    @app_commands.describe(member="Member to show the stats of")
+    @art.command()
+    async def stats(self, interaction: discord.Interaction, member: discord.Member):
+        """Shows the gallery stats of a member"""
+        if not (artist := self.get_artist(member)) or not artist.art_count:
+            return await interaction.response.send_message(
+                "This user doesnt have a gallery", ephemeral=True
+            )
+        embed = discord.Embed(
+            title=f"{member.display_name}'s gallery stats", color=gen_color(member.id)
+        )
+        embed.add_field(name="Pieces", value=str(artist.art_count))
+        if artist.first_upload:
+            embed.add_field(
+                name="First upload",
+                value=discord.utils.format_dt(artist.first_upload, "D"),
+            )
+        if artist.last_upload:
+            embed.add_field(
+                name="Last upload",
+                value=discord.utils.format_dt(artist.last_upload, "D"),
+            )
+        with self.bot.read_session(interaction.guild.id) as s:
+            activity = (
+                s.query(ArtistActivity.month, ArtistActivity.count)
+                .filter(ArtistActivity.artist_id == artist.id, ArtistActivity.count > 0)
+                .order_by(ArtistActivity.month.desc())
+                .limit(12)
+                .all()
+            )
+        if activity:
+            embed.add_field(
+                name="Activity",
+                value="\n".join(f"{a.month}: {a.count}" for a in activity),
+                inline=False,
+            )
+        await interaction.response.send_message(embed=embed)
+
     artist = app_commands.Group(
         name="artist", description="Commands for managing artists"
     )
@@ -327,13 +1073,57 @@ class Gallery(commands.Cog):
         if artist is None:
             await interaction.response.send_message(f"{member} doesnt have a gallery")
             return
+        for art in artist.gallery:
+            self.unindex_art(member.guild.id, art)
         self.bot.s.delete(artist)
         self.bot.s.commit()
         await interaction.response.send_message("Artist deleted")
 
+    async def collect_entries(
+        self,
+        channel: discord.TextChannel,
+        after: int,
+        pinned: bool = True,
+        min_reactions: int = 0,
+        has_attachment: bool = False,
+    ):
+        """Yields the messages in channel after the snowflake that match the criteria"""
+        if pinned:
+            messages = self.pinned_after(channel, after)
+        else:
+            # Fetched in pages of 100 messages as the iteration goes
+            messages = channel.history(
+                limit=None, after=discord.Object(id=after), oldest_first=True
+            )
+        async for msg in messages:
+            if has_attachment and not msg.attachments:
+                continue
+            if (
+                min_reactions
+                and sum(reaction.count for reaction in msg.reactions) < min_reactions
+            ):
+                continue
+            yield msg
+
+    @staticmethod
+    async def pinned_after(channel: discord.TextChannel, after: int):
+        """Yields the pinned messages in channel after the snowflake, oldest first"""
+        for msg in sorted(await channel.pins(), key=lambda msg: msg.id):
+            if msg.id <= after:
+                continue
+            # Pins come without complete reaction data
+            try:
+                yield await channel.fetch_message(msg.id)
+            except discord.NotFound:
+                continue
+
     @app_commands.checks.has_permissions(kick_members=True)
     @app_commands.describe(
-        after="Will get all pinned messages after this date. Format YYYY-MM-DD."
+        after="Will get all messages after this date. Format YYYY-MM-DD.",
+        pinned="Only get pinned messages.",
+        min_reactions="Only get messages with at least this many reactions.",
+        has_attachment="Only get messages with attachments.",
+        file_format="Format of the entries file.",
     )
     @app_commands.guild_only
     @app_commands.command()
@@ -341,6 +1131,10 @@ class Gallery(commands.Cog):
         self,
         interaction: discord.Interaction,
         after: app_commands.Transform[datetime.datetime, DateTransformer],
+        pinned: bool = True,
+        min_reactions: int = 0,
+        has_attachment: bool = False,
+        file_format: Literal["csv", "ndjson"] = "csv",
     ):
         """Gets contest entries if there is any."""
         assert interaction.guild is not None
@@ -355,23 +1149,41 @@ class Gallery(commands.Cog):
 
         assert isinstance(art_channel, discord.TextChannel)
 
+        await interaction.response.defer(ephemeral=True)
         floor_snowflake = discord.utils.time_snowflake(after)
+        fields = ["author", "author_id", "message_id", "url", "content", "reactions"]
 
-        entries = []
-        for msg in await art_channel.pins():
-            if msg.id > floor_snowflake:
-                if msg.attachments:
-                    entries.append(
-                        f"{msg.author.name}({msg.author.id}) - {msg.attachments[0].url}"
-                    )
+        with tempfile.TemporaryFile() as fp:
+            out = io.TextIOWrapper(fp, encoding="utf-8", newline="")
+            writer = csv.DictWriter(out, fields)
+            if file_format == "csv":
+                writer.writeheader()
+            count = 0
+            async for msg in self.collect_entries(
+                art_channel, floor_snowflake, pinned, min_reactions, has_attachment
+            ):
+                row = {
+                    "author": msg.author.name,
+                    "author_id": msg.author.id,
+                    "message_id": msg.id,
+                    "url": msg.attachments[0].url if msg.attachments else msg.jump_url,
+                    "content": msg.content,
+                    "reactions": sum(reaction.count for reaction in msg.reactions),
+                }
+                if file_format == "csv":
+                    writer.writerow(row)
                 else:
-                    entries.append(
-                        f"{msg.author.name}({msg.author.id}) - {msg.content}"
-                    )
-        if entries:
-            await interaction.response.send_message("\n".join(entries), ephemeral=True)
-        else:
-            await interaction.response.send_message("No entries found.", ephemeral=True)
+                    out.write(json.dumps(row) + "\n")
+                count += 1
+            out.flush()
+            out.detach()
+            if not count:
+                return await interaction.followup.send("No entries found.")
+            fp.seek(0)
+            await interaction.followup.send(
+                f"Found {count} entries.",
+                file=discord.File(fp, filename=f"contest_entries.{file_format}"),
+            )
 
 
 async def setup(bot):
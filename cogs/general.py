@@ -1,14 +1,20 @@
 from __future__ import annotations
 
+import asyncio
+import datetime
 import discord
 import subprocess
 import platform
+import sqlite3
 
 from discord import app_commands
-from discord.ext import commands
-from typing import TYPE_CHECKING
+from discord.ext import commands, tasks
+from sqlalchemy.exc import OperationalError
+from typing import TYPE_CHECKING, Optional
+from utils.backup import BackupError, backup_database
 from utils.database import Guild, BlackList
 from utils.exceptions import BotOwnerOnly
+from utils.retention import compact, prune_history
 
 if TYPE_CHECKING:
     from main import Mayushii
@@ -38,9 +44,95 @@ class General(commands.Cog):
             callback=self.getpfp_menu_callback,
         )
         self.bot.tree.add_command(self.getpfp_menu)
+        # Days to keep the votes and raffle entries of ended polls and raffles
+        self.retention_days: Optional[int] = self.bot.config.get("retention_days")
+        self.history_dir: Optional[str] = self.bot.config.get("history_archive_dir")
+        self.pruning = False
+        self.backup_dir: Optional[str] = self.bot.config.get("backup_dir")
+
+    async def cog_load(self):
+        if self.retention_days:
+            self.retention_loop.start()
+        if self.backup_dir:
+            self.backup_loop.change_interval(
+                hours=self.bot.config.get("backup_interval_hours", 24)
+            )
+            self.backup_loop.start()
 
     async def cog_unload(self):
         self.bot.tree.remove_command(self.getpfp_menu.name, type=self.getpfp_menu.type)
+        self.retention_loop.cancel()
+        self.backup_loop.cancel()
+
+    async def backup_job(self) -> str:
+        paths = []
+        for engine in self.bot.engines():
+            path = await asyncio.to_thread(
+                backup_database,
+                engine,
+                self.backup_dir,
+                keep=self.bot.config.get("backup_keep", 7),
+                compress=self.bot.config.get("backup_compress", False),
+            )
+            self.logger.info(f"Backed up the database to {path}")
+            paths.append(path.name)
+        return ", ".join(paths)
+
+    @tasks.loop(hours=24)
+    async def backup_loop(self):
+        try:
+            await self.backup_job()
+        except (BackupError, OSError, sqlite3.Error) as e:
+            self.logger.error(f"Failed to back up the database: {type(e)}:{e}")
+
+    async def prune_job(
+        self, days: int, interaction: Optional[discord.Interaction] = None
+    ) -> tuple[int, int, int]:
+        """Prunes the history older than days and compacts the database,
+        reporting progress to the interaction every few seconds"""
+        before = datetime.datetime.now(datetime.UTC) - datetime.timedelta(days=days)
+        voters = entries = pages = 0
+        counts = [0, 0]
+
+        def progress(pruned_voters: int, pruned_entries: int):
+            counts[:] = voters + pruned_voters, entries + pruned_entries
+
+        self.pruning = True
+        try:
+            for engine in self.bot.engines():
+                task = asyncio.create_task(
+                    asyncio.to_thread(
+                        prune_history, engine, before, self.history_dir, progress
+                    )
+                )
+                while not task.done():
+                    await asyncio.wait({task}, timeout=5)
+                    if interaction and not task.done():
+                        await interaction.edit_original_response(
+                            content=f"Pruning... {counts[0]} votes and {counts[1]} raffle entries so far."
+                        )
+                pruned_voters, pruned_entries = task.result()
+                voters += pruned_voters
+                entries += pruned_entries
+                try:
+                    pages += await asyncio.to_thread(compact, engine)
+                except OperationalError as e:
+                    self.logger.warning(f"Failed to compact the database: {e}")
+        finally:
+            self.pruning = False
+        self.logger.info(
+            f"Pruned {voters} votes and {entries} raffle entries, released {pages} pages"
+        )
+        return voters, entries, pages
+
+    @tasks.loop(hours=24)
+    async def retention_loop(self):
+        if self.pruning or not self.retention_days:
+            return
+        try:
+            await self.prune_job(self.retention_days)
+        except Exception as e:
+            self.logger.error(f"Failed to prune history: {type(e)}:{e}")
 
     @commands.has_guild_permissions(manage_guild=True)
     @commands.guild_only()
@@ -157,6 +249,49 @@ class General(commands.Cog):
             "Profile picture changed successfully.", ephemeral=True
         )
 
+    @app_commands.check(bot_owner_only)
+    @app_commands.describe(
+        days="Keep the votes and entries of polls and raffles ended in the last days"
+    )
+    @group_bot.command()
+    async def prune(self, interaction, days: Optional[int] = None):
+        """Archives old votes and raffle entries and compacts the database"""
+        if (days := days or self.retention_days) is None:
+            return await interaction.response.send_message(
+                "No retention period configured.", ephemeral=True
+            )
+        if self.pruning:
+            return await interaction.response.send_message(
+                "Pruning already in progress.", ephemeral=True
+            )
+        await interaction.response.send_message("Pruning...")
+        try:
+            voters, entries, pages = await self.prune_job(days, interaction)
+        except Exception as e:
+            self.logger.error(f"Failed to prune history: {type(e)}:{e}")
+            return await interaction.edit_original_response(
+                content="Failed to prune history."
+            )
+        await interaction.edit_original_response(
+            content=f"Pruned {voters} votes and {entries} raffle entries, released {pages} pages."
+        )
+
+    @app_commands.check(bot_owner_only)
+    @group_bot.command()
+    async def backup(self, interaction):
+        """Backs up the database"""
+        if not self.backup_dir:
+            return await interaction.response.send_message(
+                "No backup directory configured.", ephemeral=True
+            )
+        await interaction.response.defer()
+        try:
+            name = await self.backup_job()
+        except (BackupError, OSError, sqlite3.Error) as e:
+            self.logger.error(f"Failed to back up the database: {type(e)}:{e}")
+            return await interaction.followup.send("Failed to back up the database.")
+        await interaction.followup.send(f"Database backed up to {name}.")
+
     @app_commands.check(bot_owner_only)
     @app_commands.describe(channel="Text channel to set as the error channel")
     @group_bot.command()
@@ -200,6 +335,8 @@ class General(commands.Cog):
             dbguild = self.bot.s.get(Guild, interaction.guild.id)
             dbguild.flags ^= self.cogs[cog]
             self.bot.s.commit()
+            if cog == "gallery" and (gallery := self.bot.get_cog("Gallery")):
+                gallery.update_routes()
             return await interaction.response.send_message("Cog toggled.")
         await interaction.response.send_message("Cog not found.")
 
@@ -6,8 +6,10 @@ import discord
 
 from discord import app_commands
 from discord.ext import commands, tasks
-from utils.database import GiveawayRole, Guild
+from sqlalchemy import func
+from utils.database import Giveaway, GiveawayEntry, GiveawayRole, Guild
 from utils.managers import RaffleManager
+from utils.partitions import use_guild
 from utils.exceptions import NoOnGoingRaffle
 from utils.utilities import (
     ConfirmationButtons,
@@ -19,8 +21,7 @@ from utils.views import RaffleView, LinkButton
 
 
 def ongoing_raffle(interaction):
-    raffle = interaction.client.raffle_manager.get_raffle(interaction.guild.id)
-    if raffle and raffle.ongoing:
+    if interaction.client.raffle_manager.get_guild_raffles(interaction.guild.id):
         return True
     raise NoOnGoingRaffle("There is no ongoing raffle.")
 
@@ -43,7 +44,7 @@ class Raffle(commands.GroupCog):
         self.queue = asyncio.Queue()
 
     async def cog_load(self):
-        for guild_id, raffle in self.bot.raffle_manager.raffles.items():
+        for raffle in self.bot.raffle_manager.raffles.values():
             view = RaffleView(
                 custom_id=raffle.custom_id,
                 message_id=raffle.message_id,
@@ -51,23 +52,50 @@ class Raffle(commands.GroupCog):
                 channel_id=raffle.channel_id,
             )
             self.bot.add_view(view)
+        self.bot.raffle_manager.resume_role_grants()
         self.check_views.start()
 
     @tasks.loop(seconds=60.0)
     async def check_views(self):
         now = datetime.datetime.now(datetime.UTC)
-        for raffle in self.bot.raffle_manager.raffles.values():
+        for raffle in list(self.bot.raffle_manager.raffles.values()):
             if raffle.end_date and raffle.end_date < now:
-                view = discord.utils.get(
-                    self.bot.persistent_views, custom_id=raffle.custom_id
-                )
-                await self.bot.raffle_manager.end_raffle(raffle, view)
+                use_guild(raffle.guild_id)
+                await self.bot.raffle_manager.stop_raffle(raffle)
+
+    async def get_target_raffle(
+        self, interaction: discord.Interaction, raffle_id: Optional[int]
+    ) -> Optional[Giveaway]:
+        """Gets the ongoing raffle a command refers to, replying if there is none"""
+        assert interaction.guild is not None
+        raffle = self.bot.raffle_manager.find_raffle(interaction.guild.id, raffle_id)
+        if raffle is None:
+            if raffle_id is None:
+                msg = "There are several ongoing raffles, specify one"
+            else:
+                msg = "No ongoing raffle associated with provided ID"
+            await interaction.response.send_message(msg, ephemeral=True)
+        return raffle
+
+    async def ongoing_raffle_autocomplete(
+        self, interaction: discord.Interaction, current: str
+    ) -> list[app_commands.Choice[int]]:
+        current = current.lower()
+        return [
+            app_commands.Choice(name=raffle.name[:100], value=raffle.id)
+            for raffle in self.bot.raffle_manager.get_guild_raffles(
+                interaction.guild.id
+            )
+            if current in raffle.name.lower()
+        ][:25]
 
     @app_commands.checks.has_permissions(manage_channels=True)
     @app_commands.describe(
         name="Name of the new raffle",
         winners="Number of winners",
         allowed_roles="Roles allowed to participate",
+        winner_role="Role given to the winners when the raffle ends",
+        role_for_entrants="Give the winner role to every entrant instead",
     )
     @app_commands.command()
     async def create(
@@ -86,6 +114,8 @@ class Raffle(commands.GroupCog):
         allowed_roles: app_commands.Transform[
             Optional[list[discord.Role]], GreedyRoleTransformer
         ] = None,
+        winner_role: Optional[discord.Role] = None,
+        role_for_entrants: bool = False,
     ):
         """Creates a giveaway"""
 
@@ -94,11 +124,6 @@ class Raffle(commands.GroupCog):
                 "This command can't be used in DMs!"
             )
 
-        if self.bot.raffle_manager.get_raffle(interaction.guild.id):
-            return await interaction.response.send_message(
-                "There is an already ongoing giveaway!", ephemeral=True
-            )
-
         if lasts and end_date:
             return await interaction.response.send_message(
                 "end_date and lasts parameters are mutually exclusive", ephemeral=True
@@ -107,6 +132,10 @@ class Raffle(commands.GroupCog):
             return await interaction.response.send_message(
                 "A poll has to last longer than 10 minutes", ephemeral=True
             )
+        if winner_role and not winner_role.is_assignable():
+            return await interaction.response.send_message(
+                "I can't assign the winner role.", ephemeral=True
+            )
 
         embed = discord.Embed(title="Proposed Giveaway", color=discord.Color.purple())
         embed.add_field(name="Name", value=name, inline=False)
@@ -118,6 +147,12 @@ class Raffle(commands.GroupCog):
                 value=" ".join(role.name for role in allowed_roles),
                 inline=False,
             )
+        if winner_role:
+            embed.add_field(
+                name="Entrant role" if role_for_entrants else "Winner role",
+                value=winner_role.name,
+                inline=False,
+            )
         view = ConfirmationButtons()
         await interaction.response.send_message(
             "Is this giveaway correct?", embed=embed, view=view, ephemeral=True
@@ -161,8 +196,10 @@ class Raffle(commands.GroupCog):
                 custom_id=interaction.id,
                 start_date=start,
                 end_date=end_date,
+                winner_role=winner_role,
+                role_for_entrants=role_for_entrants,
             )
-            self.bot.raffle_manager.raffles[interaction.guild.id] = raffle
+            self.bot.raffle_manager.add_raffle(raffle)
             await msg.edit(
                 content="",
                 embed=self.bot.raffle_manager.create_embed(
@@ -179,11 +216,15 @@ class Raffle(commands.GroupCog):
 
     @app_commands.checks.has_permissions(manage_channels=True)
     @app_commands.check(ongoing_raffle)
-    @commands.guild_only()
     @app_commands.command()
-    async def info(self, interaction):
+    @app_commands.describe(raffle_id="Ongoing raffle, optional if there is only one")
+    @app_commands.autocomplete(raffle_id=ongoing_raffle_autocomplete)
+    async def info(
+        self, interaction: discord.Interaction, raffle_id: Optional[int] = None
+    ):
         """Shows information about current giveaway"""
-        raffle = self.bot.raffle_manager.raffles[interaction.guild.id]
+        if (raffle := await self.get_target_raffle(interaction, raffle_id)) is None:
+            return
         embed = discord.Embed()
         embed.add_field(name="ID", value=raffle.id, inline=False)
         embed.add_field(name="Name", value=raffle.name, inline=False)
@@ -193,15 +234,30 @@ class Raffle(commands.GroupCog):
                 value="\n".join(role.id for role in raffle.roles),
                 inline=False,
             )
-        embed.add_field(
-            name="Number of entries", value=str(len(raffle.entries)), inline=False
-        )
+        with self.bot.read_session(raffle.guild_id) as s:
+            entries = (
+                s.query(func.count())
+                .select_from(GiveawayEntry)
+                .filter(GiveawayEntry.giveaway_id == raffle.id)
+                .scalar()
+            )
+        embed.add_field(name="Number of entries", value=str(entries), inline=False)
+        if raffle.winner_role:
+            embed.add_field(
+                name="Entrant role" if raffle.role_for_entrants else "Winner role",
+                value=f"<@&{raffle.winner_role}>",
+                inline=False,
+            )
         await interaction.response.send_message(embed=embed)
 
     @app_commands.checks.has_permissions(manage_channels=True)
     @app_commands.check(ongoing_raffle)
     @app_commands.command()
-    async def cancel(self, interaction: discord.Interaction):
+    @app_commands.describe(raffle_id="Ongoing raffle, optional if there is only one")
+    @app_commands.autocomplete(raffle_id=ongoing_raffle_autocomplete)
+    async def cancel(
+        self, interaction: discord.Interaction, raffle_id: Optional[int] = None
+    ):
         """Cancels current giveaway"""
 
         if interaction.guild is None:
@@ -209,15 +265,18 @@ class Raffle(commands.GroupCog):
                 "This command can't be used in DMs!"
             )
 
+        if (raffle := await self.get_target_raffle(interaction, raffle_id)) is None:
+            return
         view = ConfirmationButtons()
         await interaction.response.send_message(
-            "Are you sure you want to cancel current giveaway?", view=view
+            f"Are you sure you want to cancel the {raffle.name} giveaway?", view=view
         )
+        await view.wait()
         if view.value:
-            self.bot.raffle_manager.raffles[interaction.guild.id].ongoing = False
-            del self.bot.raffle_manager.raffles[interaction.guild.id]
-            await self.bot.raffle_manager.views[interaction.guild.id].stop()
-            del self.bot.raffle_manager.views[interaction.guild.id]
+            raffle.ongoing = False
+            self.bot.raffle_manager.remove_raffle(raffle)
+            if (raffle_view := self.bot.raffle_manager.get_view(raffle)) is not None:
+                await raffle_view.stop()
             self.bot.s.commit()
             return await interaction.edit_original_response(
                 content="Giveaway cancelled.", view=None
@@ -229,46 +288,111 @@ class Raffle(commands.GroupCog):
     @app_commands.checks.has_permissions(manage_channels=True)
     @app_commands.check(ongoing_raffle)
     @app_commands.command()
-    async def finish(self, interaction: discord.Interaction):
+    @app_commands.describe(raffle_id="Ongoing raffle, optional if there is only one")
+    @app_commands.autocomplete(raffle_id=ongoing_raffle_autocomplete)
+    async def finish(
+        self, interaction: discord.Interaction, raffle_id: Optional[int] = None
+    ):
         """Finishes the current raffle"""
         if interaction.guild is None:
             return await interaction.response.send_message(
                 "This command can't be used in DMs!"
             )
 
-        await self.bot.raffle_manager.stop_raffle(interaction.guild.id)
-        await interaction.response.send_message("Raffle finished!")
+        if (raffle := await self.get_target_raffle(interaction, raffle_id)) is None:
+            return
+        # Drawing looks members up through the gateway, which can take longer
+        # than an interaction may go unanswered
+        await interaction.response.defer()
+        await self.bot.raffle_manager.stop_raffle(raffle)
+        await interaction.followup.send("Raffle finished!")
+
+    @app_commands.checks.has_permissions(manage_channels=True)
+    @app_commands.command()
+    @app_commands.describe(raffle_id="ID of a finished raffle")
+    async def results(self, interaction: discord.Interaction, raffle_id: int):
+        """Shows the results of a finished raffle"""
+        if interaction.guild is None:
+            return await interaction.response.send_message(
+                "This command can't be used in DMs!"
+            )
+
+        raffle = self.bot.s.get(Giveaway, raffle_id)
+        if raffle is None or raffle.guild_id != interaction.guild.id:
+            return await interaction.response.send_message(
+                "No raffle associated with provided ID", ephemeral=True
+            )
+        if raffle.result is None:
+            return await interaction.response.send_message(
+                "This raffle has no results", ephemeral=True
+            )
+        embed = discord.Embed(title=raffle.name)
+        embed.add_field(name="ID", value=raffle.id, inline=False)
+        embed.add_field(
+            name="Closed",
+            value=discord.utils.format_dt(raffle.result.closed_at, "F"),
+            inline=False,
+        )
+        embed.add_field(
+            name="Number of entries", value=str(raffle.result.entries), inline=False
+        )
+        embed.add_field(
+            name="Winners",
+            value=" ".join(f"<@{user_id}>" for user_id in raffle.result.winners)
+            or "None",
+            inline=False,
+        )
+        await interaction.response.send_message(embed=embed)
 
     modify = app_commands.Group(
         name="modify", description="Commands to modify a raffle"
     )
 
     @app_commands.checks.has_permissions(manage_channels=True)
-    @app_commands.describe(new_value="New amount of winners")
+    @app_commands.check(ongoing_raffle)
     @modify.command()
-    async def winner_count(self, interaction, new_value: int):
+    @app_commands.describe(
+        new_value="New amount of winners",
+        raffle_id="Ongoing raffle, optional if there is only one",
+    )
+    @app_commands.autocomplete(raffle_id=ongoing_raffle_autocomplete)
+    async def winner_count(
+        self,
+        interaction: discord.Interaction,
+        new_value: int,
+        raffle_id: Optional[int] = None,
+    ):
         """Modify number of winners for the ongoing raffle"""
-        self.bot.raffle_manager.raffles[interaction.guild.id].win_count = new_value
+        if (raffle := await self.get_target_raffle(interaction, raffle_id)) is None:
+            return
+        raffle.win_count = new_value
         self.bot.s.commit()
         await interaction.response.send_message(
             f"Updated number of winners to {new_value}"
         )
 
     @app_commands.checks.has_permissions(manage_channels=True)
-    @app_commands.describe(new_role="Role to allow in the raffle")
+    @app_commands.check(ongoing_raffle)
     @modify.command()
+    @app_commands.describe(
+        new_role="Role to allow in the raffle",
+        raffle_id="Ongoing raffle, optional if there is only one",
+    )
+    @app_commands.autocomplete(raffle_id=ongoing_raffle_autocomplete)
     async def add_allowed_role(
         self,
         interaction: discord.Interaction,
         new_role: discord.Role,
+        raffle_id: Optional[int] = None,
     ):
         """Add a role to raffle"""
         if interaction.guild is None:
             return await interaction.response.send_message(
                 "This command can't be used in DMs!"
             )
-        raffle = self.bot.raffle_manager.get_raffle(interaction.guild.id)
-        self.bot.s.add(GiveawayRole(id=new_role.id, giveaway=raffle.id))
+        if (raffle := await self.get_target_raffle(interaction, raffle_id)) is None:
+            return
+        self.bot.s.add(GiveawayRole(id=new_role.id, giveaway_id=raffle.id))
         self.bot.s.commit()
         await interaction.response.send_message(
             f"Added role {new_role.name} to the raffle"
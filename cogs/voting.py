@@ -3,9 +3,10 @@ import datetime
 
 from discord.ext import commands, tasks
 from discord import app_commands
-from typing import Optional
+from typing import Literal, Optional
 from utils.database import Poll, Guild
 from utils.managers import VoteManager
+from utils.partitions import use_guild
 from utils.utilities import ConfirmationButtons, TimeTransformer, DateTransformer
 from utils.views import VoteView, LinkButton
 
@@ -15,6 +16,64 @@ def is_enabled(interaction):
     return dbguild.flags & 0b1000
 
 
+class PollHistoryView(discord.ui.View):
+    page_size = 10
+
+    def __init__(self, interaction: discord.Interaction, poll_manager: VoteManager):
+        super().__init__(timeout=60)
+        self.inter = interaction
+        self.manager = poll_manager
+        # Id after the last poll of every page shown so far, None for the first
+        self.cursors: list[Optional[int]] = [None]
+        self.results = []
+        self.load_page()
+
+    async def on_timeout(self):
+        await self.inter.edit_original_response(view=None)
+
+    def load_page(self):
+        assert self.inter.guild is not None
+        rows = self.manager.poll_history(
+            self.inter.guild.id,
+            before_id=self.cursors[-1],
+            limit=self.page_size + 1,
+        )
+        self.results = rows[: self.page_size]
+        self.prev_page.disabled = len(self.cursors) == 1
+        self.next_page.disabled = len(rows) <= self.page_size
+
+    def create_embed(self):
+        embed = discord.Embed(title="Poll List")
+        for poll_id, name, mode, active, start, end, votes in self.results:
+            msg = (
+                f"id={poll_id}\n"
+                f"mode={mode}\n"
+                f"active={active}\n"
+                f"votes={votes}\n"
+            )
+            if start:
+                msg += f"start={discord.utils.format_dt(start, 'd')}\n"
+            embed.add_field(name=name, value=msg)
+        embed.set_footer(text=f"Page {len(self.cursors)}")
+        return embed
+
+    @discord.ui.button(label="Back", style=discord.ButtonStyle.primary)
+    async def prev_page(
+        self, interaction: discord.Interaction, button: discord.ui.Button
+    ):
+        self.cursors.pop()
+        self.load_page()
+        await interaction.response.edit_message(embed=self.create_embed(), view=self)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.primary)
+    async def next_page(
+        self, interaction: discord.Interaction, button: discord.ui.Button
+    ):
+        self.cursors.append(self.results[-1][0])
+        self.load_page()
+        await interaction.response.edit_message(embed=self.create_embed(), view=self)
+
+
 @app_commands.guild_only
 @app_commands.default_permissions(manage_channels=True)
 class Voting(commands.GroupCog, name="poll"):
@@ -27,10 +86,11 @@ class Voting(commands.GroupCog, name="poll"):
         self.bot.poll_manager = VoteManager(self.bot)
 
     async def cog_load(self):
-        for guild, poll in self.bot.poll_manager.polls.items():
+        for poll in self.bot.poll_manager.polls.values():
             self.bot.add_view(
                 VoteView(
                     options=poll.parsed_options,
+                    mode=poll.mode,
                     custom_id=poll.custom_id,
                     message_id=poll.message_id,
                     poll_manager=self.bot.poll_manager,
@@ -43,12 +103,39 @@ class Voting(commands.GroupCog, name="poll"):
     @tasks.loop(seconds=60.0)
     async def check_views(self):
         now = datetime.datetime.now(datetime.UTC)
-        for poll in self.bot.poll_manager.polls.values():
+        for poll in list(self.bot.poll_manager.polls.values()):
             if poll.end and poll.end < now:
+                use_guild(poll.guild_id)
                 view = discord.utils.get(
                     self.bot.persistent_views, custom_id=poll.custom_id
                 )
-                await self.bot.poll_manager.end_poll(poll, view)
+                await self.bot.poll_manager.end_poll(poll, view, announce=True)
+
+    async def get_target_poll(
+        self, interaction: discord.Interaction, poll_id: Optional[int]
+    ) -> Optional[Poll]:
+        """Gets the ongoing poll a command refers to, replying if there is none"""
+        assert interaction.guild is not None
+        poll = self.bot.poll_manager.find_poll(interaction.guild.id, poll_id)
+        if poll is None:
+            if poll_id is None and self.bot.poll_manager.get_guild_polls(
+                interaction.guild.id
+            ):
+                msg = "There are several ongoing polls, specify one"
+            else:
+                msg = "No ongoing poll"
+            await interaction.response.send_message(msg, ephemeral=True)
+        return poll
+
+    async def ongoing_poll_autocomplete(
+        self, interaction: discord.Interaction, current: str
+    ) -> list[app_commands.Choice[int]]:
+        current = current.lower()
+        return [
+            app_commands.Choice(name=poll.name[:100], value=poll.id)
+            for poll in self.bot.poll_manager.get_guild_polls(interaction.guild.id)
+            if current in poll.name.lower()
+        ][:25]
 
     @app_commands.checks.has_permissions(manage_channels=True)
     @app_commands.command()
@@ -59,6 +146,7 @@ class Voting(commands.GroupCog, name="poll"):
         target_channel="Channel to post the poll",
         end_date="End date of poll. dd/mm/yy hh:mm:ss format. Time is optional",
         lasts="How long the poll lasts. #d#h#m#s format.",
+        mode="single: one option per voter, approval: any number of options, ranked: instant runoff",
     )
     async def create(
         self,
@@ -73,6 +161,7 @@ class Voting(commands.GroupCog, name="poll"):
         lasts: app_commands.Transform[Optional[int], TimeTransformer] = None,
         attachment: Optional[discord.Attachment] = None,
         url: Optional[str] = None,
+        mode: Literal["single", "approval", "ranked"] = "single",
     ):
         """Creates a poll"""
 
@@ -81,10 +170,6 @@ class Voting(commands.GroupCog, name="poll"):
                 "This command can't be used in DMs!"
             )
 
-        if self.bot.poll_manager.get_ongoing_poll(interaction.guild.id):
-            return await interaction.response.send_message(
-                "There is an ongoing poll!", ephemeral=True
-            )
         if lasts and end_date:
             return await interaction.response.send_message(
                 "end_date and lasts parameters are mutually exclusive"
@@ -94,10 +179,16 @@ class Voting(commands.GroupCog, name="poll"):
                 "A poll has to last longer than 10 minutes"
             )
         parsed_options = self.bot.poll_manager.parse_options(options)
+        # Ranked ballots need two more buttons than there are options
+        if len(parsed_options) > (23 if mode == "ranked" else 25):
+            return await interaction.response.send_message(
+                "Too many options for this poll", ephemeral=True
+            )
         embed = discord.Embed(title="Proposed Poll", color=discord.Color.green())
         embed.add_field(name="Name", value=name, inline=False)
         embed.add_field(name="Description", value=description, inline=False)
         embed.add_field(name="Options", value=" ".join(parsed_options), inline=False)
+        embed.add_field(name="Mode", value=mode, inline=False)
         conf_view = ConfirmationButtons()
         await interaction.response.send_message(
             "Is this poll correct?", view=conf_view, embed=embed, ephemeral=True
@@ -119,6 +210,7 @@ class Voting(commands.GroupCog, name="poll"):
                     )
             vote_view = VoteView(
                 options=parsed_options,
+                mode=mode,
                 custom_id=interaction.id,
                 poll_manager=self.bot.poll_manager,
                 channel_id=target_channel.id,
@@ -142,6 +234,7 @@ class Voting(commands.GroupCog, name="poll"):
                 start=start,
                 end=end_date,
                 channel_id=msg.channel.id,
+                mode=mode,
             )
             await msg.edit(
                 content=None,
@@ -150,7 +243,7 @@ class Voting(commands.GroupCog, name="poll"):
             poll.active = True
             self.bot.s.commit()
             self.logger.info(f"Enabled poll {poll.name}")
-            self.bot.poll_manager.polls[interaction.guild.id] = poll
+            self.bot.poll_manager.add_poll(poll)
             await interaction.edit_original_response(
                 content="Poll Created!", view=None, embed=None
             )
@@ -161,17 +254,19 @@ class Voting(commands.GroupCog, name="poll"):
 
     @app_commands.checks.has_permissions(manage_channels=True)
     @app_commands.command()
-    async def close(self, interaction: discord.Interaction):
+    @app_commands.describe(poll_id="Ongoing poll, optional if there is only one")
+    @app_commands.autocomplete(poll_id=ongoing_poll_autocomplete)
+    async def close(
+        self, interaction: discord.Interaction, poll_id: Optional[int] = None
+    ):
         """Closes a poll"""
         if interaction.guild is None:
             return await interaction.response.send_message(
                 "This command can't be used in DMs!"
             )
 
-        if (
-            poll := self.bot.poll_manager.get_ongoing_poll(interaction.guild.id)
-        ) is None:
-            return await interaction.response.send_message("No ongoing poll")
+        if (poll := await self.get_target_poll(interaction, poll_id)) is None:
+            return
 
         view = discord.utils.get(self.bot.persistent_views, custom_id=poll.custom_id)
         await self.bot.poll_manager.end_poll(poll, view, announce=True)
@@ -179,7 +274,11 @@ class Voting(commands.GroupCog, name="poll"):
 
     @app_commands.checks.has_permissions(manage_channels=True)
     @app_commands.command()
-    async def cancel(self, interaction: discord.Interaction):
+    @app_commands.describe(poll_id="Ongoing poll, optional if there is only one")
+    @app_commands.autocomplete(poll_id=ongoing_poll_autocomplete)
+    async def cancel(
+        self, interaction: discord.Interaction, poll_id: Optional[int] = None
+    ):
         """Cancels a poll"""
 
         if interaction.guild is None:
@@ -187,10 +286,8 @@ class Voting(commands.GroupCog, name="poll"):
                 "This command can't be used in DMs!"
             )
 
-        if (
-            poll := self.bot.poll_manager.get_ongoing_poll(interaction.guild.id)
-        ) is None:
-            return await interaction.response.send_message("No ongoing poll")
+        if (poll := await self.get_target_poll(interaction, poll_id)) is None:
+            return
 
         view = discord.utils.get(self.bot.persistent_views, custom_id=poll.custom_id)
         await self.bot.poll_manager.end_poll(poll, view, announce=False)
@@ -198,7 +295,11 @@ class Voting(commands.GroupCog, name="poll"):
 
     @app_commands.checks.has_permissions(ban_members=True)
     @app_commands.command()
-    async def tally(self, interaction: discord.Interaction):
+    @app_commands.describe(poll_id="Ongoing poll, optional if there is only one")
+    @app_commands.autocomplete(poll_id=ongoing_poll_autocomplete)
+    async def tally(
+        self, interaction: discord.Interaction, poll_id: Optional[int] = None
+    ):
         """Show the current state of the poll"""
 
         if interaction.guild is None:
@@ -206,10 +307,8 @@ class Voting(commands.GroupCog, name="poll"):
                 "This command can't be used in DMs!"
             )
 
-        if (
-            poll := self.bot.poll_manager.get_ongoing_poll(interaction.guild.id)
-        ) is None:
-            return await interaction.response.send_message("There is no ongoing poll")
+        if (poll := await self.get_target_poll(interaction, poll_id)) is None:
+            return
         result = self.bot.poll_manager.count_votes(poll)
         embed = discord.Embed()
         msg = ""
@@ -228,23 +327,10 @@ class Voting(commands.GroupCog, name="poll"):
                 "This command can't be used in DMs!"
             )
 
-        polls = (
-            self.bot.s.query(Poll).filter(Poll.guild_id == interaction.guild.id).all()
-        )
-        if polls:
-            embed = discord.Embed(title="Poll List")
-            for poll in polls:
-                msg = (
-                    f"id={poll.id}\n"
-                    f"link={poll.description}\n"
-                    f"option={poll.options}\n"
-                    f"active={poll.active}\n"
-                    f"votes={len(poll.voters)}\n"
-                )
-                embed.add_field(name=poll.name, value=msg)
-            await interaction.response.send_message(embed=embed)
-        else:
-            await interaction.response.send_message("No polls to show!")
+        view = PollHistoryView(interaction, self.bot.poll_manager)
+        if not view.results:
+            return await interaction.response.send_message("No polls to show!")
+        await interaction.response.send_message(embed=view.create_embed(), view=view)
 
     @app_commands.checks.has_permissions(manage_guild=True)
     @app_commands.command()
@@ -266,14 +352,14 @@ class Voting(commands.GroupCog, name="poll"):
                 "No poll associated with provided ID"
             )
         else:
-            if poll == self.bot.poll_manager.get_ongoing_poll(interaction.guild.id):
-                del self.bot.poll_manager.polls[interaction.guild.id]
+            self.bot.poll_manager.remove_poll(poll)
             self.bot.s.delete(poll)
             self.bot.s.commit()
             await interaction.response.send_message("Poll deleted successfully")
 
     @app_commands.checks.has_permissions(ban_members=True)
     @app_commands.command()
+    @app_commands.autocomplete(poll_id=ongoing_poll_autocomplete)
     async def info(
         self, interaction: discord.Interaction, poll_id: Optional[int] = None
     ):
@@ -284,30 +370,34 @@ class Voting(commands.GroupCog, name="poll"):
             )
 
         if poll_id is None:
-            if self.bot.poll_manager.get_ongoing_poll(interaction.guild.id) is None:
-                await interaction.response.send_message(
-                    "There is no ongoing poll", ephemeral=True
-                )
+            if (poll := await self.get_target_poll(interaction, poll_id)) is None:
                 return
-            else:
-                poll_id = self.bot.poll_manager.get_ongoing_poll(
-                    interaction.guild.id
-                ).id
+            poll_id = poll.id
         poll = self.bot.poll_manager.get_poll(poll_id, interaction.guild.id)
+        if poll is None:
+            return await interaction.response.send_message(
+                "No poll associated with provided ID", ephemeral=True
+            )
         embed = discord.Embed(title=poll.name, color=discord.Color.blurple())
         embed.add_field(name="ID", value=poll.id, inline=False)
         if poll.url:
             embed.add_field(name="Link", value=poll.url, inline=False)
         embed.add_field(
             name="Options",
-            value=" ".join(self.bot.poll_manager.parse_options(poll.options)),
+            value=" ".join(poll.parsed_options),
             inline=False,
         )
         if poll.end:
             embed.add_field(
                 name="End date", value=discord.utils.format_dt(poll.end, "F")
             )
-        result = self.bot.poll_manager.count_votes(poll)
+        if poll.result is not None:
+            embed.add_field(
+                name="Closed",
+                value=discord.utils.format_dt(poll.result.closed_at, "F"),
+            )
+            embed.add_field(name="Turnout", value=str(poll.result.turnout))
+        result = self.bot.poll_manager.get_results(poll)
         msg = ""
         for x in result.keys():
             msg += f"{x}: {result[x]}   "
@@ -6,11 +6,18 @@ import sqlalchemy.orm
 
 from discord import app_commands
 from discord.ext import commands
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 from typing import Optional
 from traceback import format_exception
-from utils.database import Guild, Base
+from utils.cooldowns import CooldownCache
+from utils.database import (
+    Guild,
+    Base,
+    create_art_search,
+    create_db_engine,
+    create_read_engine,
+    migrate,
+)
 from utils.exceptions import (
     DisabledCog,
     BotOwnerOnly,
@@ -20,6 +27,9 @@ from utils.exceptions import (
     BlackListed,
     NoArtChannel,
 )
+from utils.members import MemberResolver
+from utils.partitions import GuildRouter, GuildSession, use_guild
+from utils.retention import enable_incremental_vacuum
 from utils.utilities import create_error_embed
 
 cogs = ["cogs.gallery", "cogs.general", "cogs.voting", "cogs.raffle", "cogs.community"]
@@ -33,20 +43,66 @@ class Mayushii(commands.Bot):
     setup_complete = False
 
     def __init__(self, command_prefix, **options):
-        super().__init__(command_prefix, **options)
         self.logger = self.get_logger(self.__class__)
         self.logger.info("Loading config.json")
         with open("data/config.json") as config:
             self.config = json.load(config)
+        if not self.config.get("cache_members", True):
+            # Members are looked up on demand through self.members instead
+            options.setdefault("member_cache_flags", discord.MemberCacheFlags.none())
+            options.setdefault("chunk_guilds_at_startup", False)
+        # Longer rate limits raise discord.RateLimited instead of blocking the
+        # request, so background jobs like role grants can back off themselves
+        options.setdefault(
+            "max_ratelimit_timeout", self.config.get("max_ratelimit_timeout", 30.0)
+        )
+        super().__init__(command_prefix, **options)
         self.owner_id = self.config["owner"]
+        self.members = MemberResolver(self.config.get("member_cache_ttl", 300))
+        self.cooldowns = CooldownCache(self.config.get("cooldown_cache_size", 10000))
 
     async def setup_hook(self) -> None:
-        engine = create_engine("sqlite:///data/mayushii.db")
-        session = sessionmaker(bind=engine)
-        self.s: sqlalchemy.orm.Session = session()
-        Base.metadata.create_all(engine)
+        if partitions := self.config.get("database_partitions"):
+            self.router = GuildRouter(
+                partitions["directory"],
+                max_open=partitions.get("max_open", 16),
+                pool=self.config.get("database_pool"),
+            )
+            self.engine = None
+            self.reader = None
+            self.s: sqlalchemy.orm.Session = GuildSession(self.router)
+        else:
+            self.router = None
+            self.engine = create_db_engine(self.config)
+            session = sessionmaker(bind=self.engine)
+            self.s: sqlalchemy.orm.Session = session()
+            Base.metadata.create_all(self.engine)
+            migrate(self.engine)
+            create_art_search(self.engine)
+            self.reader = create_read_engine(self.config, self.engine)
+        # Nothing else uses the databases yet, so the VACUUM blocks no writes
+        for engine in self.engines():
+            if enable_incremental_vacuum(engine):
+                self.logger.info(f"Enabled incremental vacuum on {engine.url}")
         self.session = aiohttp.ClientSession()
 
+    def engine_for(self, guild_id: int):
+        """Engine holding the rows of a guild"""
+        return self.router.engine(guild_id) if self.router else self.engine
+
+    def reader_for(self, guild_id: int):
+        """Read-only engine for the reporting queries of a guild"""
+        return self.router.reader(guild_id) if self.router else self.reader
+
+    def read_session(self, guild_id: int) -> Session:
+        """Session for reporting queries that shouldn't compete with writes,
+        it sees what the bot session has committed"""
+        return Session(self.reader_for(guild_id))
+
+    def engines(self):
+        """Every database engine, one per guild when partitioned"""
+        return self.router.all_engines() if self.router else [self.engine]
+
     @staticmethod
     def get_logger(object):
         logger = logging.getLogger(object.__class__.__name__)
@@ -76,6 +132,12 @@ class Mayushii(commands.Bot):
         self.logger.info(f"Initialized on {','.join(x.name for x in self.guilds)}")
         self.setup_complete = True
 
+    async def on_member_join(self, member: discord.Member):
+        self.members.forget(member.guild.id, member.id)
+
+    async def on_raw_member_remove(self, payload: discord.RawMemberRemoveEvent):
+        self.members.forget(payload.guild_id, payload.user.id)
+
     async def load_cogs(self):
         for cog in cogs:
             try:
@@ -151,6 +213,10 @@ class Mayushii(commands.Bot):
     async def close(self) -> None:
         await self.session.close()
         self.s.close()
+        if self.router:
+            self.router.dispose()
+        elif self.reader is not self.engine:
+            self.reader.dispose()
         await super().close()
 
 
@@ -163,6 +229,10 @@ class Mayutree(app_commands.CommandTree):
         self.bot = client
         self.logger = logging.getLogger(__name__)
 
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        use_guild(interaction.guild_id)
+        return True
+
     async def on_error(
         self,
         interaction: discord.Interaction,
@@ -189,17 +259,18 @@ class Mayutree(app_commands.CommandTree):
                 "Command not found.", ephemeral=True
             )
 
-        elif isinstance(error, app_commands.CheckFailure):
-            await interaction.response.send_message(
-                f"You cannot use {command_name}.", ephemeral=True
-            )
-
+        # A subclass of CheckFailure, so it goes first
         elif isinstance(error, app_commands.CommandOnCooldown):
             await interaction.response.send_message(
                 f"This command is on cooldown, try again in {error.retry_after:.2f}s.",
                 ephemeral=True,
             )
 
+        elif isinstance(error, app_commands.CheckFailure):
+            await interaction.response.send_message(
+                f"You cannot use {command_name}.", ephemeral=True
+            )
+
         else:
             msg = f"Unhandled exception in `{command_name}`"
             try:
@@ -0,0 +1,111 @@
+"""Times the prebuilt statements of utils/queries.py against the Query forms
+they replaced, on an in-memory SQLite database.
+
+    python scripts/bench_queries.py [iterations]
+
+Each pair is checked to return the same result before being timed, the best
+of 5 runs is reported per call.
+"""
+
+import os
+import sys
+import time
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils import queries  # noqa: E402
+from utils.database import Art, Artist, Base, Guild, Poll, Voter  # noqa: E402
+
+
+def setup() -> Session:
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    s = Session(engine)
+    s.add(Guild(id=1))
+    s.add(Artist(id=1, userid=5, guild=1))
+    s.add(Art(id=1, artist_id=1, link="https://example.com/art.png"))
+    s.add(
+        Poll(
+            id=1,
+            guild_id=1,
+            name="poll",
+            custom_id=1,
+            active=True,
+            channel_id=1,
+            message_id=1,
+            author_id=1,
+        )
+    )
+    s.add_all(Voter(userid=n, poll_id=1, option_id=n % 3) for n in range(20))
+    s.commit()
+    return s
+
+
+def cases(s: Session) -> dict:
+    return {
+        "get_artist": (
+            lambda: s.query(Artist)
+            .filter(Artist.userid == 5, Artist.guild == 1)
+            .one_or_none(),
+            lambda: s.scalars(
+                queries.artist_by_member, {"userid": 5, "guild": 1}
+            ).one_or_none(),
+        ),
+        "art_in_guild": (
+            lambda: s.query(Art)
+            .join(Art.artist)
+            .filter(Art.id == 1, Artist.guild == 1)
+            .one_or_none(),
+            lambda: s.scalars(
+                queries.art_in_guild, {"art_id": 1, "guild": 1}
+            ).one_or_none(),
+        ),
+        "poll_in_guild": (
+            lambda: s.query(Poll)
+            .filter(Poll.id == 1, Poll.guild_id == 1)
+            .one_or_none(),
+            lambda: s.scalars(
+                queries.poll_in_guild, {"poll_id": 1, "guild": 1}
+            ).one_or_none(),
+        ),
+        "votes_per_option": (
+            lambda: dict(
+                s.query(Voter.option_id, func.count())
+                .filter(Voter.poll_id == 1)
+                .group_by(Voter.option_id)
+                .all()
+            ),
+            lambda: dict(s.execute(queries.votes_per_option, {"poll_id": 1}).all()),
+        ),
+    }
+
+
+def best(call, iterations: int) -> float:
+    """Best time of a call in microseconds"""
+    for _ in range(200):
+        call()
+    times = []
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(iterations):
+            call()
+        times.append((time.perf_counter() - start) / iterations)
+    return min(times) * 1e6
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    for name, (old, new) in cases(setup()).items():
+        assert old() == new(), f"{name}: results differ"
+        before, after = best(old, iterations), best(new, iterations)
+        print(
+            f"{name:16} {before:6.1f}us -> {after:6.1f}us"
+            f" ({(1 - after / before) * 100:.0f}% less)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Replays synthetic messages through Gallery.on_message on an in-memory
+SQLite database.
+
+    python scripts/bench_routing.py [--messages 1000000] [--baseline]
+
+A share of the messages is sent in the art channels of the guilds, the rest
+in other channels. Art channel messages carry no attachments, so only the
+routing is timed. --baseline also replays the per message Guild lookup
+on_message did before the route map, which is much slower.
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+import types
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from cogs.gallery import Gallery  # noqa: E402
+from utils.database import Base, Guild  # noqa: E402
+
+
+def make_bot(guilds: int) -> types.SimpleNamespace:
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    s = Session(engine)
+    # Every other guild has the gallery enabled
+    s.add_all(
+        Guild(id=n, art_channel=1000 + n, flags=0b10 if n % 2 else 0)
+        for n in range(guilds)
+    )
+    s.commit()
+    return types.SimpleNamespace(
+        s=s,
+        config={},
+        user=types.SimpleNamespace(id=1),
+        get_logger=lambda cog: logging.getLogger(type(cog).__name__),
+    )
+
+
+def make_messages(n: int, guilds: int, art_share: float) -> list:
+    rng = random.Random(0)
+    author = types.SimpleNamespace(id=2, bot=False)
+    messages = []
+    for _ in range(n):
+        guild_id = rng.randrange(guilds)
+        channel_id = 1000 + guild_id if rng.random() < art_share else 5000 + guild_id
+        messages.append(
+            types.SimpleNamespace(
+                guild=types.SimpleNamespace(id=guild_id),
+                channel=types.SimpleNamespace(id=channel_id),
+                author=author,
+                attachments=[],
+                content="",
+            )
+        )
+    return messages
+
+
+def old_route(cog: Gallery, message) -> bool:
+    """The checks on_message ran for every message before the route map"""
+    if message.guild is None:
+        return False
+    art_channel_id = cog.art_channels.get(message.guild.id)
+    dbguild = cog.bot.s.get(Guild, message.guild.id)
+    if not dbguild.flags & 0b10 or art_channel_id is None:
+        return False
+    return message.channel.id == art_channel_id
+
+
+async def replay(cog: Gallery, messages: list) -> float:
+    start = time.perf_counter()
+    for message in messages:
+        await cog.on_message(message)
+    return time.perf_counter() - start
+
+
+def replay_old(cog: Gallery, messages: list) -> tuple[float, int]:
+    routed = 0
+    start = time.perf_counter()
+    for message in messages:
+        routed += old_route(cog, message)
+    return time.perf_counter() - start, routed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--guilds", type=int, default=50)
+    parser.add_argument("--art-share", type=float, default=0.01)
+    parser.add_argument("--baseline", action="store_true")
+    args = parser.parse_args()
+
+    cog = Gallery(make_bot(args.guilds))
+    messages = make_messages(args.messages, args.guilds, args.art_share)
+    routed = sum(message.channel.id in cog.routes for message in messages)
+    print(f"{len(messages)} messages, {routed} in enabled art channels")
+    elapsed = asyncio.run(replay(cog, messages))
+    print(f"route map: {elapsed:.2f}s, {elapsed / len(messages) * 1e6:.2f}us/message")
+    if args.baseline:
+        elapsed, old_routed = replay_old(cog, messages)
+        assert old_routed == routed, f"guild lookup routed {old_routed} messages"
+        print(
+            f"guild lookup: {elapsed:.2f}s, {elapsed / len(messages) * 1e6:.2f}us/message"
+        )
+
+
+if __name__ == "__main__":
+    main()
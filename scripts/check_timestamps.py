@@ -0,0 +1,74 @@
+"""Checks that UTCDateTime round-trips aware UTC datetimes.
+
+Runs against an in-memory SQLite database, a SQLite file and every database
+URL given as an argument, e.g.
+
+    python scripts/check_timestamps.py postgresql://user@localhost/scratch
+
+Only a scratch table named timestamp_check is created and dropped.
+"""
+
+import os
+import sys
+import tempfile
+
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import Column, Integer, MetaData, Table, create_engine, select
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from utils.database import UTCDateTime  # noqa: E402
+
+metadata = MetaData()
+table = Table(
+    "timestamp_check",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("at", UTCDateTime),
+)
+
+NOW = datetime(2024, 3, 1, 12, 30, 15, 123456, tzinfo=timezone.utc)
+VALUES = {
+    1: NOW,
+    # Other offsets are stored as the same instant in UTC
+    2: NOW.astimezone(timezone(timedelta(hours=-5))),
+    # Naive values are taken as UTC
+    3: NOW.replace(tzinfo=None),
+}
+
+
+def check(url: str):
+    engine = create_engine(url)
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+    try:
+        with engine.begin() as conn:
+            conn.execute(
+                table.insert(), [{"id": id, "at": at} for id, at in VALUES.items()]
+            )
+        with engine.connect() as conn:
+            rows = dict(conn.execute(select(table.c.id, table.c.at)).all())
+            before = conn.execute(
+                select(table.c.id).where(table.c.at < NOW + timedelta(seconds=1))
+            ).all()
+        for id, at in rows.items():
+            assert at.tzinfo is not None, f"{url}: row {id} loaded naive"
+            assert at == NOW, f"{url}: row {id} loaded as {at}"
+            assert at.utcoffset() == timedelta(0), f"{url}: row {id} not in UTC"
+        assert len(before) == len(VALUES), f"{url}: comparison matched {before}"
+    finally:
+        metadata.drop_all(engine)
+        engine.dispose()
+    print(f"ok {engine.dialect.name}")
+
+
+def main():
+    check("sqlite://")
+    with tempfile.TemporaryDirectory() as directory:
+        check(f"sqlite:///{os.path.join(directory, 'check.db')}")
+    for url in sys.argv[1:]:
+        check(url)
+
+
+if __name__ == "__main__":
+    main()
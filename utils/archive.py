@@ -0,0 +1,140 @@
+import gzip
+import json
+
+from datetime import datetime
+from sqlalchemy import Engine, select
+from sqlalchemy.orm import Session
+from typing import NamedTuple, Optional
+from utils.database import Art, Artist, UTCDateTime
+
+BATCH_SIZE = 500
+
+ART_FIELDS = [
+    column.name
+    for column in Art.__table__.columns
+    if column.name not in ("id", "artist_id")
+]
+DATE_FIELDS = {
+    column.name
+    for column in Art.__table__.columns
+    if isinstance(column.type, UTCDateTime)
+}
+
+
+class ImportResult(NamedTuple):
+    artists: int
+    arts: int
+    duplicates: int
+    # id and perceptual hash of the imported art
+    new_art: list[tuple[int, Optional[str]]]
+
+
+def encode(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def export_gallery(engine: Engine, guild_id: int, path: str) -> tuple[int, int]:
+    """Writes the artists and art of a guild to a gzipped NDJSON file.
+
+    Rows are read in keyset batches, each in its own short transaction, so
+    memory use is constant and writers are never blocked for long.
+    """
+    artists = arts = 0
+    with gzip.open(path, "wt", encoding="utf-8") as fp, Session(engine) as s:
+        last_id = 0
+        while rows := s.execute(
+            select(Artist.id, Artist.userid)
+            .where(Artist.guild == guild_id, Artist.id > last_id)
+            .order_by(Artist.id)
+            .limit(BATCH_SIZE)
+        ).all():
+            s.rollback()
+            for artist_id, userid in rows:
+                fp.write(
+                    json.dumps({"type": "artist", "id": artist_id, "userid": userid})
+                    + "\n"
+                )
+            artists += len(rows)
+            last_id = rows[-1].id
+
+        last_id = 0
+        while rows := s.scalars(
+            select(Art)
+            .join(Art.artist)
+            .where(Artist.guild == guild_id, Art.id > last_id)
+            .order_by(Art.id)
+            .limit(BATCH_SIZE)
+        ).all():
+            for art in rows:
+                entry = {"type": "art", "id": art.id, "artist_id": art.artist_id}
+                entry.update(
+                    (field, encode(getattr(art, field))) for field in ART_FIELDS
+                )
+                fp.write(json.dumps(entry) + "\n")
+            arts += len(rows)
+            last_id = rows[-1].id
+            s.rollback()
+            s.expunge_all()
+    return artists, arts
+
+
+def import_gallery(engine: Engine, guild_id: int, path: str) -> ImportResult:
+    """Imports a file written by export_gallery into a guild.
+
+    Rows are inserted in batched transactions with new ids. Artists that
+    already have a gallery in the guild keep it and get the imported art added.
+    Art whose link is already in the guild is skipped, so an archive can be
+    imported again safely.
+    """
+    artist_ids: dict[int, int] = {}
+    artists = duplicates = 0
+    new_art = []
+    with gzip.open(path, "rt", encoding="utf-8") as fp, Session(engine) as s:
+        existing = dict(
+            s.execute(
+                select(Artist.userid, Artist.id).where(Artist.guild == guild_id)
+            ).all()
+        )
+        links = set(
+            s.scalars(select(Art.link).join(Art.artist).where(Artist.guild == guild_id))
+        )
+        pending = []
+
+        def flush():
+            s.add_all(pending)
+            s.flush()
+            new_art.extend((art.id, art.phash) for art in pending)
+            s.commit()
+            pending.clear()
+
+        for n, line in enumerate(fp, start=1):
+            entry = json.loads(line)
+            if entry["type"] == "artist":
+                if entry["userid"] in existing:
+                    artist_ids[entry["id"]] = existing[entry["userid"]]
+                    continue
+                artist = Artist(userid=entry["userid"], guild=guild_id)
+                s.add(artist)
+                s.flush()
+                artist_ids[entry["id"]] = existing[entry["userid"]] = artist.id
+                artists += 1
+            elif entry["type"] == "art":
+                if (artist_id := artist_ids.get(entry["artist_id"])) is None:
+                    continue
+                if entry["link"] in links:
+                    duplicates += 1
+                    continue
+                links.add(entry["link"])
+                values = {
+                    field: (
+                        datetime.fromisoformat(entry[field])
+                        if field in DATE_FIELDS and entry.get(field)
+                        else entry.get(field)
+                    )
+                    for field in ART_FIELDS
+                }
+                pending.append(Art(artist_id=artist_id, **values))
+            if n % BATCH_SIZE == 0:
+                flush()
+        flush()
+    return ImportResult(artists, len(new_art), duplicates, new_art)
@@ -0,0 +1,88 @@
+import gzip
+import os
+import shutil
+import sqlite3
+
+from datetime import datetime
+from pathlib import Path
+from sqlalchemy import Engine
+
+# Pages copied per backup step, the source is only locked during a step
+PAGES_PER_STEP = 256
+# A write from another connection restarts a stepped backup from the first page
+MAX_RESTARTS = 5
+
+
+class BackupError(Exception):
+    pass
+
+
+class BackupRestarted(Exception):
+    pass
+
+
+def copy_database(src: sqlite3.Connection, dst: sqlite3.Connection):
+    """Copies src to dst in steps, or in a single step if writes keep
+    restarting the copy"""
+    restarts = 0
+    remaining_pages = None
+
+    def progress(status, remaining, total):
+        nonlocal remaining_pages, restarts
+        if remaining_pages is not None and remaining > remaining_pages:
+            restarts += 1
+            if restarts > MAX_RESTARTS:
+                raise BackupRestarted
+        remaining_pages = remaining
+
+    try:
+        src.backup(dst, pages=PAGES_PER_STEP, progress=progress, sleep=0.005)
+    except BackupRestarted:
+        src.backup(dst)
+
+
+def backup_database(
+    engine: Engine, backup_dir: str, keep: int = 7, compress: bool = False
+) -> Path:
+    """Copies a live SQLite database with the online backup API.
+
+    The copy is made in small steps from a separate connection, so writers
+    only wait for a single step, see copy_database. The copy is checked with
+    integrity_check before it is compressed and the oldest backups beyond keep
+    are removed.
+    """
+    if engine.dialect.name != "sqlite" or not engine.url.database:
+        raise BackupError("Only file based SQLite databases can be backed up")
+    directory = Path(backup_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    name = Path(engine.url.database).stem
+    path = directory / f"{name}-{datetime.now():%Y%m%d%H%M%S}.db"
+    partial = path.with_suffix(".db.partial")
+
+    src = sqlite3.connect(engine.url.database)
+    dst = sqlite3.connect(partial)
+    try:
+        copy_database(src, dst)
+        result = dst.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        dst.close()
+        src.close()
+    if result != "ok":
+        partial.unlink()
+        raise BackupError(f"Backup failed the integrity check: {result}")
+
+    if compress:
+        path = path.with_suffix(".db.gz")
+        with open(partial, "rb") as fp, gzip.open(path, "wb") as out:
+            shutil.copyfileobj(fp, out)
+        partial.unlink()
+    else:
+        os.replace(partial, path)
+
+    backups = sorted(
+        [*directory.glob(f"{name}-*.db"), *directory.glob(f"{name}-*.db.gz")],
+        key=lambda backup: backup.name,
+    )
+    for old in backups[:-keep] if keep > 0 else []:
+        old.unlink()
+    return path
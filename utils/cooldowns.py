@@ -0,0 +1,107 @@
+import asyncio
+import time
+
+from collections import OrderedDict
+from discord import app_commands
+
+# Id each bucket type keeps its cooldowns by
+BUCKETS = {
+    "member": lambda interaction: (interaction.guild_id, interaction.user.id),
+    "guild": lambda interaction: interaction.guild_id,
+}
+
+
+class CooldownCache:
+    """Cooldowns of commands per bucket, least recently used first.
+
+    Cooldowns that have fully recovered carry no state and are dropped when
+    they reach the front. Past max_size the least recently used one is dropped
+    even if it hasn't, so memory stays bounded on large servers.
+    """
+
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self.cooldowns: OrderedDict[tuple, app_commands.Cooldown] = OrderedDict()
+
+    def get(self, key: tuple, rate: int, per: float) -> app_commands.Cooldown:
+        cooldown = self.cooldowns.get(key)
+        if cooldown is None or (cooldown.rate, cooldown.per) != (rate, per):
+            cooldown = self.cooldowns[key] = app_commands.Cooldown(rate, per)
+        self.cooldowns.move_to_end(key)
+        return cooldown
+
+    def expire(self):
+        now = time.time()
+        while len(self.cooldowns) > 1:
+            key, cooldown = next(iter(self.cooldowns.items()))
+            if len(self.cooldowns) <= self.max_size and (
+                cooldown.get_tokens(now) < cooldown.rate
+            ):
+                break
+            del self.cooldowns[key]
+
+    def __len__(self):
+        return len(self.cooldowns)
+
+
+def cooldown(**limits: tuple[int, float]):
+    """Allows a command rate uses every per seconds in each bucket given as
+    member=(rate, per) or guild=(rate, per).
+
+    The cooldowns setting of the config overrides the limits of a command by
+    its qualified name, a null limit disables the bucket.
+    """
+
+    def predicate(interaction) -> bool:
+        name = interaction.command.qualified_name
+        overrides = interaction.client.config.get("cooldowns", {}).get(name, {})
+        cache: CooldownCache = interaction.client.cooldowns
+        now = time.time()
+        cooldowns = [
+            cache.get((name, bucket, BUCKETS[bucket](interaction)), *limit)
+            for bucket, limit in {**limits, **overrides}.items()
+            if limit
+        ]
+        # Only take a token when every bucket has one
+        waits = [(c.get_retry_after(now), c) for c in cooldowns]
+        retry_after, slowest = max(waits, key=lambda wait: wait[0], default=(0, None))
+        if retry_after:
+            raise app_commands.CommandOnCooldown(slowest, retry_after)
+        for c in cooldowns:
+            c.update_rate_limit(now)
+        # After taking the tokens, so the cooldowns just used aren't recovered
+        cache.expire()
+        return True
+
+    return app_commands.check(predicate)
+
+
+class TokenBucket:
+    """Paces async work to rate calls every per seconds, allowing short bursts"""
+
+    def __init__(self, rate: int, per: float):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(
+            self.rate, self.tokens + (now - self.updated) * self.rate / self.per
+        )
+        self.updated = now
+
+    async def acquire(self):
+        async with self.lock:
+            self.refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) * self.per / self.rate)
+                self.refill()
+            self.tokens -= 1
+
+    def drain(self, seconds: float):
+        """Holds every call for seconds, after a rate limit response"""
+        self.refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate / self.per
@@ -1,30 +1,112 @@
-from sqlalchemy import Column, String, Integer, ForeignKey, Boolean, TIMESTAMP
+from datetime import datetime, timezone
+from sqlalchemy import (
+    BigInteger,
+    Column,
+    String,
+    Integer,
+    ForeignKey,
+    Boolean,
+    TIMESTAMP,
+    Index,
+    JSON,
+    LargeBinary,
+    Engine,
+    create_engine,
+    event,
+    inspect,
+    text,
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, Mapped
+from sqlalchemy.types import TypeDecorator
+from typing import Optional
 
 Base = declarative_base()
 
 
+class UTCDateTime(TypeDecorator):
+    """Timestamp stored in UTC and always loaded as an aware datetime.
+
+    SQLite keeps no offset, naive values are written and read back as UTC.
+    """
+
+    impl = TIMESTAMP(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value: Optional[datetime], dialect):
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        value = value.astimezone(timezone.utc)
+        return value.replace(tzinfo=None) if dialect.name == "sqlite" else value
+
+    def process_result_value(self, value: Optional[datetime], dialect):
+        if value is not None and value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value
+
+
 class Artist(Base):
     __tablename__ = "artist"
     id = Column(Integer, primary_key=True)
-    userid = Column(Integer)
-    guild = Column(Integer)
+    userid = Column(BigInteger)
+    guild = Column(BigInteger)
+
+    # Kept up to date by the gallery cog and refreshed periodically
+    art_count = Column(Integer, default=0)
+    first_upload = Column(UTCDateTime, default=None)
+    last_upload = Column(UTCDateTime, default=None)
+
     gallery: Mapped[list["Art"]] = relationship(
         back_populates="artist",
         cascade="all, delete, delete-orphan",
     )
+    activity: Mapped[list["ArtistActivity"]] = relationship(
+        cascade="all, delete, delete-orphan",
+    )
+
+    __table_args__ = (Index("ix_artist_guild_art_count", "guild", "art_count"),)
 
     def __repr__(self):
         return f"<Artist userid='{self.id}'>"
 
 
+class ArtistActivity(Base):
+    __tablename__ = "artist_activity"
+    artist_id = Column(Integer, ForeignKey("artist.id"), primary_key=True)
+    # YYYY-MM
+    month = Column(String, primary_key=True)
+    count = Column(Integer, default=0)
+
+    def __repr__(self):
+        return f"<ArtistActivity artist={self.artist_id}, month={self.month}, count={self.count}>"
+
+
 class Art(Base):
     __tablename__ = "gallery"
     id = Column(Integer, primary_key=True)
-    artist_id = Column(Integer, ForeignKey("artist.id"))
+    artist_id = Column(Integer, ForeignKey("artist.id"), index=True)
     link = Column(String)
     description = Column(String)
+    created_at = Column(UTCDateTime, default=None)
+
+    # Only set when the image is stored in the local media store
+    hash = Column(String, default=None)
+    size = Column(Integer, default=None)
+    width = Column(Integer, default=None)
+    height = Column(Integer, default=None)
+    # Perceptual hash as a 16 digit hex string
+    phash = Column(String, default=None)
+
+    # Source of art posted in the art channel, used to refresh the CDN link
+    channel_id = Column(BigInteger, default=None)
+    message_id = Column(BigInteger, default=None)
+    attachment_id = Column(BigInteger, default=None)
+    link_expires = Column(UTCDateTime, default=None)
+    # False once the CDN refresh endpoint stopped returning the link
+    link_refreshable = Column(Boolean, default=True)
+
     artist: Mapped["Artist"] = relationship(
         back_populates="gallery",
     )
@@ -35,8 +117,8 @@ class Art(Base):
 
 class BlackList(Base):
     __tablename__ = "blacklist"
-    userid = Column(Integer, primary_key=True)
-    guild = Column(Integer, ForeignKey("guilds.id"), primary_key=True)
+    userid = Column(BigInteger, primary_key=True)
+    guild = Column(BigInteger, ForeignKey("guilds.id"), primary_key=True)
 
     def __repr__(self):
         return f"<Blacklist userid={self.userid} in guild {self.guild}'>"
@@ -44,10 +126,11 @@ class BlackList(Base):
 
 class Guild(Base):
     __tablename__ = "guilds"
-    id = Column(Integer, primary_key=True)
+    id = Column(BigInteger, primary_key=True, autoincrement=False)
     name = Column(String)
-    error_channel = Column(Integer, default=None)
-    art_channel = Column(Integer, default=None)
+    error_channel = Column(BigInteger, default=None)
+    art_channel = Column(BigInteger, default=None)
+    spotlight_channel = Column(BigInteger, default=None)
     min_days = Column(Integer, default=7)
     flags = Column(Integer, default=0)
 
@@ -58,45 +141,89 @@ class Poll(Base):
 
     name = Column(String)
     description = Column(String)
-    options = Column(String)
     url = Column(String)
 
-    custom_id = Column(Integer)
-    author_id = Column(Integer)
+    custom_id = Column(BigInteger)
+    author_id = Column(BigInteger)
 
     # Needed to fetch the view message, ugh
-    guild_id = Column(Integer, ForeignKey("guilds.id"))
-    channel_id = Column(Integer)
-    message_id = Column(Integer)
+    guild_id = Column(BigInteger, ForeignKey("guilds.id"))
+    channel_id = Column(BigInteger)
+    message_id = Column(BigInteger)
 
     active = Column(Boolean, default=False)
-    start = Column(TIMESTAMP)
-    end = Column(TIMESTAMP)
+    start = Column(UTCDateTime)
+    end = Column(UTCDateTime)
+
+    # single, approval or ranked
+    mode = Column(String, default="single")
 
+    options: Mapped[list["PollOption"]] = relationship(
+        back_populates="poll",
+        order_by="PollOption.position",
+        cascade="all, delete, delete-orphan",
+    )
     voters: Mapped[list["Voter"]] = relationship(
         back_populates="poll", cascade="all, delete, delete-orphan"
     )
+    result: Mapped[Optional["PollResult"]] = relationship(
+        cascade="all, delete, delete-orphan"
+    )
+
+    __table_args__ = (Index("ix_polls_guild_id", "guild_id", "id"),)
 
     def __repr__(self):
-        return f"<Poll id={self.id}, name={self.name}, description={self.description}, options={self.options}, active={self.active}'>"
+        return f"<Poll id={self.id}, name={self.name}, description={self.description}, options={self.parsed_options}, active={self.active}'>"
 
     @property
-    def parsed_options(self):
-        return self.options.split("|")
+    def parsed_options(self) -> list[str]:
+        return [option.label for option in self.options]
+
+
+class PollOption(Base):
+    __tablename__ = "polloptions"
+    poll_id = Column(Integer, ForeignKey("polls.id"), primary_key=True)
+    # Index of the option, also used in the vote button custom ids
+    position = Column(Integer, primary_key=True)
+    label = Column(String)
+
+    poll: Mapped["Poll"] = relationship(back_populates="options")
+
+    def __repr__(self):
+        return f"<PollOption poll={self.poll_id}, position={self.position}, label={self.label}>"
 
 
 class Voter(Base):
     __tablename__ = "voters"
-    userid = Column(Integer, primary_key=True)
+    userid = Column(BigInteger, primary_key=True)
     poll_id = Column(Integer, ForeignKey("polls.id"), primary_key=True)
-    option = Column(String, default=None)
+    # Position of the chosen PollOption
+    option_id = Column(Integer, default=None)
+    # Option positions of approval and ranked votes, see utils.tally
+    ballot = Column(LargeBinary, default=None)
 
     poll: Mapped["Poll"] = relationship(back_populates="voters")
 
+    __table_args__ = (Index("ix_voters_poll_option", "poll_id", "option_id"),)
+
     def __repr__(self):
         return f"<Voter userid={self.userid}'>"
 
 
+class PollResult(Base):
+    """Summary of a poll written when it ends"""
+
+    __tablename__ = "pollresults"
+    poll_id = Column(Integer, ForeignKey("polls.id"), primary_key=True)
+    # Votes per option label, the last round for ranked polls
+    totals = Column(JSON)
+    turnout = Column(Integer)
+    closed_at = Column(UTCDateTime)
+
+    def __repr__(self):
+        return f"<PollResult poll={self.poll_id}, turnout={self.turnout}>"
+
+
 class Giveaway(Base):
     __tablename__ = "giveaway"
 
@@ -105,19 +232,22 @@ class Giveaway(Base):
     description = Column(String)
     url = Column(String)
 
-    author_id = Column(Integer)
-    custom_id = Column(Integer)
+    author_id = Column(BigInteger)
+    custom_id = Column(BigInteger)
 
     # Needed to fetch the view message, ugh
-    guild_id = Column(Integer, ForeignKey("guilds.id"))
-    channel_id = Column(Integer)
-    message_id = Column(Integer)
+    guild_id = Column(BigInteger, ForeignKey("guilds.id"))
+    channel_id = Column(BigInteger)
+    message_id = Column(BigInteger)
 
     ongoing = Column(Boolean, default=False)
-    start_date = Column(TIMESTAMP)
-    end_date = Column(TIMESTAMP)
+    start_date = Column(UTCDateTime)
+    end_date = Column(UTCDateTime)
     max_participants = Column(Integer)
     win_count = Column(Integer)
+    # Role granted when the raffle ends, to the winners or every entrant
+    winner_role = Column(BigInteger)
+    role_for_entrants = Column(Boolean, default=False)
 
     entries: Mapped[list["GiveawayEntry"]] = relationship(
         back_populates="giveaway", cascade="all, delete, delete-orphan"
@@ -127,6 +257,9 @@ class Giveaway(Base):
         back_populates="giveaway",
         cascade="all, delete, delete-orphan",
     )
+    result: Mapped[Optional["GiveawayResult"]] = relationship(
+        cascade="all, delete, delete-orphan"
+    )
 
     def __repr__(self):
         return f"<Giveaway id={self.id}, name={self.name}, win_count={self.win_count}, ongoing={self.ongoing}>"
@@ -134,7 +267,7 @@ class Giveaway(Base):
 
 class GiveawayRole(Base):
     __tablename__ = "giveawayroles"
-    id = Column(Integer, primary_key=True)
+    id = Column(BigInteger, primary_key=True)
     giveaway_id = Column(Integer, ForeignKey("giveaway.id"), primary_key=True)
 
     giveaway: Mapped["Giveaway"] = relationship(back_populates="roles")
@@ -145,10 +278,11 @@ class GiveawayRole(Base):
 
 class GiveawayEntry(Base):
     __tablename__ = "giveawayentries"
-    user_id = Column(Integer, primary_key=True)
+    user_id = Column(BigInteger, primary_key=True)
     giveaway_id = Column(Integer, ForeignKey("giveaway.id"), primary_key=True)
 
     winner = Column(Boolean, default=False)
+    role_granted = Column(Boolean, default=False)
 
     giveaway: Mapped["Giveaway"] = relationship(back_populates="entries")
 
@@ -156,10 +290,188 @@ class GiveawayEntry(Base):
         return f"<GiveawayEntry giveaway={self.giveaway_id}, winner={self.winner}>"
 
 
+class GiveawayResult(Base):
+    """Summary of a raffle written when it ends"""
+
+    __tablename__ = "giveawayresults"
+    giveaway_id = Column(Integer, ForeignKey("giveaway.id"), primary_key=True)
+    # User ids of the winners
+    winners = Column(JSON)
+    entries = Column(Integer)
+    closed_at = Column(UTCDateTime)
+
+    def __repr__(self):
+        return f"<GiveawayResult giveaway={self.giveaway_id}, entries={self.entries}>"
+
+
 class CommunityRole(Base):
     __tablename__ = "community_roles"
-    id = Column(Integer, primary_key=True)
-    guild = Column(Integer, ForeignKey("guilds.id"), primary_key=True)
+    id = Column(BigInteger, primary_key=True)
+    guild = Column(BigInteger, ForeignKey("guilds.id"), primary_key=True)
     name = Column(String)
     alias = Column(String)
     description = Column(String)
+
+
+def pool_options(config: dict) -> dict:
+    pool = config.get("database_pool") or {}
+    options = {}
+    if "size" in pool:
+        options["pool_size"] = pool["size"]
+    if "max_overflow" in pool:
+        options["max_overflow"] = pool["max_overflow"]
+    if "recycle" in pool:
+        options["pool_recycle"] = pool["recycle"]
+    if "pre_ping" in pool:
+        options["pool_pre_ping"] = pool["pre_ping"]
+    return options
+
+
+def is_sqlite_file(engine: Engine) -> bool:
+    return engine.dialect.name == "sqlite" and engine.url.database not in (
+        None,
+        "",
+        ":memory:",
+    )
+
+
+def create_db_engine(config: dict) -> Engine:
+    """Creates the engine for the database_url and database_pool settings of
+    the config, defaulting to the SQLite database in data"""
+    engine = create_engine(
+        config.get("database_url", "sqlite:///data/mayushii.db"),
+        **pool_options(config),
+    )
+    if is_sqlite_file(engine):
+        # Readers see a snapshot of the WAL and never block the writer
+        @event.listens_for(engine, "connect")
+        def set_journal_mode(dbapi_connection, connection_record):
+            # Only applies to new databases, existing ones are switched by
+            # enable_incremental_vacuum
+            dbapi_connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+    return engine
+
+
+def create_read_engine(config: dict, engine: Engine) -> Engine:
+    """Creates the engine for reporting queries.
+
+    Uses database_replica_url if set, otherwise separate query_only connections
+    to the SQLite file of engine. Other databases without a replica share
+    engine, their readers don't block writers anyway.
+    """
+    if url := config.get("database_replica_url"):
+        return create_engine(url, **pool_options(config))
+    if not is_sqlite_file(engine):
+        return engine
+    reader = create_engine(engine.url)
+
+    @event.listens_for(reader, "connect")
+    def set_query_only(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA query_only=ON")
+
+    return reader
+
+
+def migrate(engine):
+    """Adds the columns and indexes missing from tables created by older versions"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(
+                        text(
+                            f'ALTER TABLE {table.name} ADD COLUMN "{column.name}" {column_type}'
+                        )
+                    )
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        migrate_poll_options(conn)
+
+
+def migrate_poll_options(conn):
+    """Moves poll options stored as "A|B|C" strings and voter choices stored as
+    option labels to the polloptions table and option indexes"""
+    inspector = inspect(conn)
+    if "options" not in {column["name"] for column in inspector.get_columns("polls")}:
+        return
+    for poll_id, options in conn.execute(text("SELECT id, options FROM polls")).all():
+        labels = options.split("|") if options else []
+        if not labels:
+            continue
+        conn.execute(
+            PollOption.__table__.insert(),
+            [
+                {"poll_id": poll_id, "position": n, "label": label}
+                for n, label in enumerate(labels)
+            ],
+        )
+        conn.execute(
+            text(
+                "UPDATE voters SET option_id = :position "
+                "WHERE poll_id = :poll_id AND option = :label"
+            ),
+            [
+                {"poll_id": poll_id, "position": n, "label": label}
+                for n, label in reversed(list(enumerate(labels)))
+            ],
+        )
+    conn.execute(text("ALTER TABLE voters DROP COLUMN option"))
+    conn.execute(text("ALTER TABLE polls DROP COLUMN options"))
+
+
+def create_art_search(engine):
+    """Creates the full text index of art descriptions and the triggers keeping it in sync"""
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = 'art_search'")
+        ).first()
+        conn.execute(
+            text(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS art_search "
+                "USING fts5(description, userid, guild, tokenize='unicode61 remove_diacritics 2')"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE TRIGGER IF NOT EXISTS art_search_insert AFTER INSERT ON gallery BEGIN "
+                "INSERT INTO art_search(rowid, description, userid, guild) "
+                "SELECT new.id, new.description, artist.userid, artist.guild "
+                "FROM artist WHERE artist.id = new.artist_id; "
+                "END"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE TRIGGER IF NOT EXISTS art_search_delete AFTER DELETE ON gallery BEGIN "
+                "DELETE FROM art_search WHERE rowid = old.id; "
+                "END"
+            )
+        )
+        conn.execute(
+            text(
+                "CREATE TRIGGER IF NOT EXISTS art_search_update "
+                "AFTER UPDATE OF description, artist_id ON gallery BEGIN "
+                "DELETE FROM art_search WHERE rowid = old.id; "
+                "INSERT INTO art_search(rowid, description, userid, guild) "
+                "SELECT new.id, new.description, artist.userid, artist.guild "
+                "FROM artist WHERE artist.id = new.artist_id; "
+                "END"
+            )
+        )
+        if not exists:
+            conn.execute(
+                text(
+                    "INSERT INTO art_search(rowid, description, userid, guild) "
+                    "SELECT gallery.id, gallery.description, artist.userid, artist.guild "
+                    "FROM gallery JOIN artist ON artist.id = gallery.artist_id"
+                )
+            )
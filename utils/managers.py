@@ -1,13 +1,35 @@
 from __future__ import annotations
 
+import asyncio
 import discord
 import random
 
-from datetime import datetime
+from datetime import datetime, UTC
 from main import Mayushii
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
 from typing import Optional, Literal
-from utils.database import Poll, Voter, Giveaway, GiveawayEntry, GiveawayRole
+from utils.database import (
+    Poll,
+    PollOption,
+    PollResult,
+    Voter,
+    Giveaway,
+    GiveawayEntry,
+    GiveawayResult,
+    GiveawayRole,
+)
+from utils.cooldowns import TokenBucket
 from utils.exceptions import NoOnGoingPoll
+from utils.members import QUERY_SIZE
+from utils.partitions import use_guild
+from utils.queries import poll_ballots, poll_in_guild, votes_per_option
+from utils.tally import (
+    approval_tally,
+    ballot_matrix,
+    encode_ballot,
+    instant_runoff,
+)
 from utils.utilities import gen_color
 from utils.views import RaffleView
 
@@ -15,13 +37,31 @@ from utils.views import RaffleView
 class VoteManager:
     def __init__(self, bot: Mayushii):
         self.bot = bot
-        self.polls: dict[int, Poll] = {
-            poll.guild_id: poll
-            for poll in self.bot.s.query(Poll).filter_by(active=True).all()
-        }
+        # Ongoing polls by the custom_id of their view
+        self.polls: dict[int, Poll] = {}
+        # Ongoing polls by guild id and poll id
+        self.guild_polls: dict[int, dict[int, Poll]] = {}
+        for poll in (
+            self.bot.s.query(Poll)
+            .filter_by(active=True)
+            .execution_options(all_guilds=True)
+            .all()
+        ):
+            self.add_poll(poll)
+
+    def add_poll(self, poll: Poll):
+        self.polls[poll.custom_id] = poll
+        self.guild_polls.setdefault(poll.guild_id, {})[poll.id] = poll
 
-    def get_voter(self, member: discord.Member):
-        return self.bot.s.get(Voter, (member.id, self.polls[member.guild.id].id))
+    def remove_poll(self, poll: Poll):
+        self.polls.pop(poll.custom_id, None)
+        if (polls := self.guild_polls.get(poll.guild_id)) is not None:
+            polls.pop(poll.id, None)
+            if not polls:
+                del self.guild_polls[poll.guild_id]
+
+    def get_voter(self, member: discord.Member, poll: Poll):
+        return self.bot.s.get(Voter, (member.id, poll.id))
 
     @staticmethod
     def parse_options(options: str):
@@ -40,12 +80,17 @@ class VoteManager:
         options: str,
         start: datetime,
         end: Optional[datetime] = None,
+        mode: str = "single",
     ):
         poll = Poll(
             name=name,
+            mode=mode,
             guild_id=guild_id,
             description=description,
-            options=options,
+            options=[
+                PollOption(position=n, label=label)
+                for n, label in enumerate(self.parse_options(options))
+            ],
             url=url,
             message_id=message_id,
             author_id=author_id,
@@ -58,38 +103,108 @@ class VoteManager:
         self.bot.s.commit()
         return poll
 
-    def count_votes(self, poll: Poll) -> dict[str, int]:
-        result = {}
-        for option in self.parse_options(poll.options):
-            c = (
-                self.bot.s.query(Voter)
-                .filter_by(poll_id=poll.id, option=option)
-                .count()
-            )
-            result[option] = c
-        return result
+    def count_votes(self, poll: Poll, s: Optional[Session] = None) -> dict[str, int]:
+        s = s or self.bot.s
+        if poll.mode in ("approval", "ranked"):
+            return self.count_ballots(poll, s)
+        counts = dict(s.execute(votes_per_option, {"poll_id": poll.id}).all())
+        return {label: counts.get(n, 0) for n, label in enumerate(poll.parsed_options)}
 
-    def get_ongoing_poll(self, guild_id) -> Optional[Poll]:
-        return self.polls.get(guild_id)
+    def count_ballots(self, poll: Poll, s: Session) -> dict[str, int]:
+        """Counts approval votes, or the last instant runoff round of ranked votes"""
+        labels = poll.parsed_options
+        ballots = s.scalars(poll_ballots, {"poll_id": poll.id}).all()
+        matrix = ballot_matrix(ballots, len(labels))
+        if poll.mode == "approval":
+            counts = approval_tally(matrix, len(labels))
+        else:
+            counts = instant_runoff(matrix, len(labels))[-1]
+        return {label: int(counts[n]) for n, label in enumerate(labels)}
+
+    def save_ballot(self, member: discord.Member, poll: Poll, choices: list[int]):
+        ballot = encode_ballot(choices, len(poll.options))
+        if (voter := self.get_voter(member, poll)) is None:
+            self.bot.s.add(Voter(userid=member.id, poll_id=poll.id, ballot=ballot))
+        else:
+            voter.ballot = ballot
+        self.bot.s.commit()
 
-    def ongoing_poll(self, guild_id) -> Literal[True]:
-        if self.get_ongoing_poll(guild_id) is None:
+    def get_ongoing_poll(self, custom_id: int) -> Optional[Poll]:
+        return self.polls.get(custom_id)
+
+    def get_guild_polls(self, guild_id: int) -> list[Poll]:
+        return list(self.guild_polls.get(guild_id, {}).values())
+
+    def find_poll(self, guild_id: int, poll_id: Optional[int] = None) -> Optional[Poll]:
+        """Gets an ongoing poll of a guild, or the only one if no id is given"""
+        polls = self.guild_polls.get(guild_id, {})
+        if poll_id is not None:
+            return polls.get(poll_id)
+        return next(iter(polls.values())) if len(polls) == 1 else None
+
+    def ongoing_poll(self, custom_id: int) -> Literal[True]:
+        if self.get_ongoing_poll(custom_id) is None:
             raise NoOnGoingPoll("There is no ongoing poll")
         return True
 
+    def poll_history(
+        self, guild_id: int, before_id: Optional[int] = None, limit: int = 10
+    ):
+        """Returns (id, name, mode, active, start, end, votes) of the polls of a
+        guild newest first, starting before the poll with before_id"""
+        with self.bot.read_session(guild_id) as s:
+            query = (
+                s.query(
+                    Poll.id,
+                    Poll.name,
+                    Poll.mode,
+                    Poll.active,
+                    Poll.start,
+                    Poll.end,
+                    func.coalesce(PollResult.turnout, func.count(Voter.userid)),
+                )
+                .outerjoin(PollResult, PollResult.poll_id == Poll.id)
+                .outerjoin(Voter, Voter.poll_id == Poll.id)
+                .filter(Poll.guild_id == guild_id)
+            )
+            if before_id is not None:
+                query = query.filter(Poll.id < before_id)
+            return (
+                query.group_by(Poll.id, PollResult.turnout)
+                .order_by(Poll.id.desc())
+                .limit(limit)
+                .all()
+            )
+
     def get_poll(self, poll_id: int, guild_id):
-        return (
-            self.bot.s.query(Poll)
-            .filter(Poll.id == poll_id, Poll.guild_id == guild_id)
-            .one_or_none()
+        return self.bot.s.scalars(
+            poll_in_guild, {"poll_id": poll_id, "guild": guild_id}
+        ).one_or_none()
+
+    def get_results(self, poll: Poll) -> dict[str, int]:
+        """Votes per option, from the stored summary once the poll has ended"""
+        if poll.result is not None:
+            return poll.result.totals
+        with self.bot.read_session(poll.guild_id) as s:
+            return self.count_votes(poll, s)
+
+    def save_result(self, poll: Poll) -> PollResult:
+        poll.result = PollResult(
+            totals=self.count_votes(poll),
+            turnout=self.bot.s.query(func.count())
+            .select_from(Voter)
+            .filter(Voter.poll_id == poll.id)
+            .scalar(),
+            closed_at=datetime.now(UTC),
         )
+        return poll.result
 
     async def end_poll(self, poll: Poll, view, announce: bool):
 
         await view.stop()
 
+        result = self.save_result(poll).totals
         if announce:
-            result = self.count_votes(poll)
             embed = discord.Embed(
                 title=f"The {poll.name} has ended!",
                 description="Congratulations to the winner!",
@@ -104,33 +219,36 @@ class VoteManager:
             except (discord.Forbidden, discord.HTTPException):
                 pass
 
-        del self.polls[poll.guild_id]
+        self.remove_poll(poll)
         poll.active = False  # type: ignore
         self.bot.s.commit()
 
-    async def process_vote(self, interaction: discord.Interaction, option: str):
-        assert interaction.guild is not None
+    async def process_vote(
+        self, interaction: discord.Interaction, custom_id: int, option: int
+    ):
         assert isinstance(interaction.user, discord.Member)
-        voter = self.get_voter(interaction.user)
-        poll = self.get_ongoing_poll(interaction.guild.id)
+        poll = self.get_ongoing_poll(custom_id)
         if poll is None:  # Could this happen?
             return
+        voter = self.get_voter(interaction.user, poll)
+        labels = poll.parsed_options
         if voter is None:
-            voter = Voter(userid=interaction.user.id, poll_id=poll.id, option=option)
+            voter = Voter(userid=interaction.user.id, poll_id=poll.id, option_id=option)
             self.bot.s.add(voter)
             await interaction.response.send_message(
-                f"Voted for {option} successfully!", ephemeral=True
+                f"Voted for {labels[option]} successfully!", ephemeral=True
             )
         else:
-            old_vote = voter.option
-            if voter.option == option:
+            old_vote = voter.option_id
+            if voter.option_id == option:
                 await interaction.response.send_message(
                     "No change in your vote!", ephemeral=True
                 )
             else:
-                voter.option = option
+                voter.option_id = option
                 await interaction.response.send_message(
-                    f"Vote changed from {old_vote} to {voter.option}!", ephemeral=True
+                    f"Vote changed from {labels[old_vote]} to {labels[option]}!",
+                    ephemeral=True,
                 )
         self.bot.s.commit()
 
@@ -146,10 +264,32 @@ class VoteManager:
 class RaffleManager:
     def __init__(self, bot: Mayushii):
         self.bot = bot
-        self.raffles: dict[int, Giveaway] = {
-            raffle.guild_id: raffle
-            for raffle in self.bot.s.query(Giveaway).filter_by(ongoing=True).all()
-        }
+        # Ongoing raffles by the custom_id of their view
+        self.raffles: dict[int, Giveaway] = {}
+        # Ongoing raffles by guild id and raffle id
+        self.guild_raffles: dict[int, dict[int, Giveaway]] = {}
+        self.logger = self.bot.get_logger(self)
+        # Winner role grants running by raffle id, and their pace per guild
+        self.grant_jobs: dict[int, asyncio.Task] = {}
+        self.grant_buckets: dict[int, TokenBucket] = {}
+        for raffle in (
+            self.bot.s.query(Giveaway)
+            .filter_by(ongoing=True)
+            .execution_options(all_guilds=True)
+            .all()
+        ):
+            self.add_raffle(raffle)
+
+    def add_raffle(self, raffle: Giveaway):
+        self.raffles[raffle.custom_id] = raffle
+        self.guild_raffles.setdefault(raffle.guild_id, {})[raffle.id] = raffle
+
+    def remove_raffle(self, raffle: Giveaway):
+        self.raffles.pop(raffle.custom_id, None)
+        if (raffles := self.guild_raffles.get(raffle.guild_id)) is not None:
+            raffles.pop(raffle.id, None)
+            if not raffles:
+                del self.guild_raffles[raffle.guild_id]
 
     def create_raffle(
         self,
@@ -166,6 +306,8 @@ class RaffleManager:
         custom_id: int,
         start_date: datetime,
         end_date: Optional[datetime],
+        winner_role: Optional[discord.Role] = None,
+        role_for_entrants: bool = False,
     ):
         raffle = Giveaway(
             name=name,
@@ -181,6 +323,8 @@ class RaffleManager:
             message_id=message_id,
             start_date=start_date,
             end_date=end_date,
+            winner_role=winner_role.id if winner_role else None,
+            role_for_entrants=role_for_entrants,
         )
         self.bot.s.add(raffle)
         self.bot.s.commit()
@@ -193,33 +337,53 @@ class RaffleManager:
         self.bot.s.commit()
         return raffle
 
-    def get_raffle(self, guild_id: int) -> Optional[Giveaway]:
-        return self.raffles.get(guild_id)
+    def get_raffle(self, custom_id: int) -> Optional[Giveaway]:
+        return self.raffles.get(custom_id)
 
-    def get_winners(self, guild_id: int) -> list[discord.Member]:
-        raffle = self.raffles[guild_id]
-        guild = self.bot.get_guild(guild_id)
-        winners = []
+    def get_guild_raffles(self, guild_id: int) -> list[Giveaway]:
+        return list(self.guild_raffles.get(guild_id, {}).values())
+
+    def find_raffle(
+        self, guild_id: int, raffle_id: Optional[int] = None
+    ) -> Optional[Giveaway]:
+        """Gets an ongoing raffle of a guild, or the only one if no id is given"""
+        raffles = self.guild_raffles.get(guild_id, {})
+        if raffle_id is not None:
+            return raffles.get(raffle_id)
+        return next(iter(raffles.values())) if len(raffles) == 1 else None
 
-        if len(raffle.entries) >= raffle.win_count:
-            while len(winners) != raffle.win_count:
-                entry: GiveawayEntry = random.choice(raffle.entries)
-                if (winner := guild.get_member(entry.user_id)) is not None:  # type: ignore
+    async def get_winners(self, raffle: Giveaway) -> list[discord.Member]:
+        """Draws the winners among the entrants still in the guild.
+
+        Entries are drawn in random order and resolved 100 at a time, so only
+        as many members as needed are looked up. Entrants that left are
+        removed, those that couldn't be checked are skipped.
+        """
+        guild = self.bot.get_guild(raffle.guild_id)
+        winners = []
+        entries = list(raffle.entries)
+        random.shuffle(entries)
+        for n in range(0, len(entries), QUERY_SIZE):
+            if len(winners) == raffle.win_count:
+                break
+            batch = entries[n : n + QUERY_SIZE]
+            members = await self.bot.members.resolve(
+                guild, [entry.user_id for entry in batch]
+            )
+            for entry in batch:
+                if len(winners) == raffle.win_count:
+                    break
+                if (winner := members.get(entry.user_id)) is not None:
                     entry.winner = True  # type: ignore
-                    self.bot.s.commit()
                     winners.append(winner)
-                else:
+                elif entry.user_id in members:
                     self.bot.s.delete(entry)
-        else:
-            for entry in raffle.entries:
-                if (winner := guild.get_member(entry.user_id)) is not None:
-                    winners.append(winner)
+        self.bot.s.commit()
         return winners
 
-    async def process_entry(self, interaction: discord.Interaction):
-        assert interaction.guild is not None
+    async def process_entry(self, interaction: discord.Interaction, custom_id: int):
         assert isinstance(interaction.user, discord.Member)
-        raffle = self.get_raffle(interaction.guild.id)
+        raffle = self.get_raffle(custom_id)
         if not raffle or not raffle.ongoing:
             return await interaction.response.send_message(
                 "The raffle has ended", ephemeral=True
@@ -244,23 +408,26 @@ class RaffleManager:
             ephemeral=True,
         )
         if raffle.max_participants and len(raffle.entries) >= raffle.max_participants:
-            await self.stop_raffle(interaction.guild.id)
+            await self.stop_raffle(raffle)
 
-    def get_view(self, guild_id: int) -> Optional[RaffleView]:
-        raffle = self.get_raffle(guild_id)
-        if not raffle:
-            return None
+    def get_view(self, raffle: Giveaway) -> Optional[RaffleView]:
         view = discord.utils.get(self.bot.persistent_views, custom_id=raffle.custom_id)
         return view if isinstance(view, RaffleView) else None
 
-    async def stop_raffle(self, guild_id: int):
-        view = self.get_view(guild_id)
-        raffle = self.raffles[guild_id]
+    async def stop_raffle(self, raffle: Giveaway):
+        view = self.get_view(raffle)
         raffle.ongoing = False  # type: ignore
         self.bot.s.commit()
+        self.remove_raffle(raffle)
+        result = await self.get_winners(raffle)
+        raffle.result = GiveawayResult(
+            winners=[winner.id for winner in result],
+            entries=len(raffle.entries),
+            closed_at=datetime.now(UTC),
+        )
+        self.bot.s.commit()
         if view is not None:
             await view.stop()
-            result = self.get_winners(guild_id)
             embed = discord.Embed(
                 title=f"The {raffle.name} raffle has ended!",
                 description="Congratulation to the winner(s)!",
@@ -273,7 +440,130 @@ class RaffleManager:
                 await view.messageable.send(embed=embed)
             except (discord.Forbidden, discord.HTTPException):
                 pass
-            del self.raffles[guild_id]
+        self.start_role_grant(raffle)
+
+    def start_role_grant(self, raffle: Giveaway):
+        if not raffle.winner_role or raffle.id in self.grant_jobs:
+            return
+        raffle_id = raffle.id
+        task = asyncio.create_task(
+            self.grant_role(
+                raffle.guild_id,
+                raffle_id,
+                raffle.winner_role,
+                bool(raffle.role_for_entrants),
+                raffle.name,
+            )
+        )
+        self.grant_jobs[raffle_id] = task
+        task.add_done_callback(lambda t: self.end_role_grant(raffle_id, t))
+
+    def end_role_grant(self, raffle_id: int, task: asyncio.Task):
+        self.grant_jobs.pop(raffle_id, None)
+        if not task.cancelled() and (e := task.exception()):
+            self.logger.error(
+                f"Role grant of raffle {raffle_id} failed: {type(e)}:{e}",
+                exc_info=e,
+            )
+
+    def resume_role_grants(self):
+        """Restarts the grants of ended raffles interrupted by a restart"""
+        pending = (
+            select(GiveawayEntry.giveaway_id)
+            .where(
+                GiveawayEntry.giveaway_id == Giveaway.id,
+                GiveawayEntry.role_granted.isnot(True),
+                (GiveawayEntry.winner == True) | (Giveaway.role_for_entrants == True),
+            )
+            .exists()
+        )
+        for raffle in (
+            self.bot.s.query(Giveaway)
+            .filter(Giveaway.ongoing == False, Giveaway.winner_role.isnot(None))
+            .filter(pending)
+            .execution_options(all_guilds=True)
+            .all()
+        ):
+            self.start_role_grant(raffle)
+
+    async def grant_role(
+        self, guild_id: int, raffle_id: int, role_id: int, to_entrants: bool, name: str
+    ) -> int:
+        """Adds the role of an ended raffle to its winners, or every entrant.
+
+        Calls are paced by a token bucket per guild below Discord's limit for
+        the route, so the library never has to hold the route for other
+        commands. Each grant is saved on the entry, a restarted job skips it.
+        """
+        use_guild(guild_id)
+        bucket = self.grant_buckets.get(guild_id)
+        if bucket is None:
+            rate, per = self.bot.config.get("role_grant_rate", (5, 5.0))
+            bucket = self.grant_buckets[guild_id] = TokenBucket(rate, per)
+        query = select(GiveawayEntry.user_id).where(
+            GiveawayEntry.giveaway_id == raffle_id,
+            GiveawayEntry.role_granted.isnot(True),
+        )
+        if not to_entrants:
+            query = query.where(GiveawayEntry.winner == True)
+        granted = 0
+        last_id = -1
+        while user_ids := self.bot.s.scalars(
+            query.where(GiveawayEntry.user_id > last_id)
+            .order_by(GiveawayEntry.user_id)
+            .limit(100)
+        ).all():
+            for user_id in user_ids:
+                try:
+                    await self.add_role(
+                        bucket, guild_id, user_id, role_id, reason=f"{name} raffle"
+                    )
+                except discord.NotFound as e:
+                    # 10011 is an unknown role, otherwise the member left
+                    if e.code == 10011:
+                        self.logger.warning(
+                            f"Role {role_id} of raffle {raffle_id} is gone"
+                        )
+                        return granted
+                except discord.Forbidden:
+                    self.logger.warning(
+                        f"Can't grant role {role_id} of raffle {raffle_id}"
+                    )
+                    return granted
+                except discord.HTTPException as e:
+                    self.logger.error(
+                        f"Failed to grant role {role_id} to {user_id}: {e}"
+                    )
+                    continue
+                else:
+                    granted += 1
+                if entry := self.bot.s.get(GiveawayEntry, (user_id, raffle_id)):
+                    entry.role_granted = True  # type: ignore
+                    self.bot.s.commit()
+            last_id = user_ids[-1]
+        return granted
+
+    async def add_role(
+        self,
+        bucket: TokenBucket,
+        guild_id: int,
+        user_id: int,
+        role_id: int,
+        reason: str,
+    ):
+        """Adds a role to a member when the bucket allows.
+
+        Rate limits longer than the client's max_ratelimit_timeout raise
+        RateLimited, the bucket is then held for the wait and the call retried.
+        """
+        while True:
+            await bucket.acquire()
+            try:
+                return await self.bot.http.add_role(
+                    guild_id, user_id, role_id, reason=reason
+                )
+            except discord.RateLimited as e:
+                bucket.drain(e.retry_after)
 
     @staticmethod
     def create_embed(raffle: Giveaway, description="") -> discord.Embed:
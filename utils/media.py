@@ -0,0 +1,167 @@
+import asyncio
+import functools
+import hashlib
+import io
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from PIL import Image
+from typing import NamedTuple, Optional
+
+
+class ImageInfo(NamedTuple):
+    hash: str
+    size: int
+    width: int
+    height: int
+    phash: int
+
+
+def dhash(image: Image.Image) -> int:
+    """64 bit difference hash of an image"""
+    pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            value = (value << 1) | (left > pixels[row * 9 + col + 1])
+    return value
+
+
+def image_path(root: Path, digest: str) -> Path:
+    return root / digest[:2] / digest
+
+
+def thumbnail_path(root: Path, digest: str) -> Path:
+    return root / "thumbnails" / digest[:2] / f"{digest}.webp"
+
+
+def write_file(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.tmp")
+    tmp.write_bytes(data)
+    os.replace(tmp, path)
+
+
+def process_image(root: str, data: bytes, thumbnail_size: int) -> ImageInfo:
+    """Stores an image and its thumbnail. Runs in a worker process."""
+    digest = hashlib.sha256(data).hexdigest()
+    with Image.open(io.BytesIO(data)) as image:
+        width, height = image.size
+        phash = dhash(image)
+        path = thumbnail_path(Path(root), digest)
+        if not path.exists():
+            image.thumbnail((thumbnail_size, thumbnail_size))
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA")
+            buffer = io.BytesIO()
+            image.save(buffer, format="WEBP", quality=80)
+            write_file(path, buffer.getvalue())
+    path = image_path(Path(root), digest)
+    if not path.exists():
+        write_file(path, data)
+    return ImageInfo(
+        hash=digest, size=len(data), width=width, height=height, phash=phash
+    )
+
+
+class MediaStore:
+    """Content addressed store for art images and their thumbnails"""
+
+    def __init__(
+        self, root: str, thumbnail_size: int = 512, workers: Optional[int] = None
+    ):
+        self.root = Path(root)
+        self.thumbnail_size = thumbnail_size
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+
+    def image_path(self, digest: str) -> Path:
+        return image_path(self.root, digest)
+
+    def thumbnail_path(self, digest: str) -> Path:
+        return thumbnail_path(self.root, digest)
+
+    def has(self, digest: str) -> bool:
+        return self.image_path(digest).exists()
+
+    async def store(self, data: bytes) -> ImageInfo:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.pool, process_image, str(self.root), data, self.thumbnail_size
+        )
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+@functools.cache
+def chunk_masks(radius: int) -> list[int]:
+    """Every 16 bit mask with at most radius bits set"""
+    return [
+        mask for mask in range(1 << HashIndex.CHUNK_BITS) if mask.bit_count() <= radius
+    ]
+
+
+class HashIndex:
+    """Multi-index hash of 64 bit perceptual hashes for Hamming distance lookups.
+
+    Hashes are split in four 16 bit chunks, each with its own table. Two hashes
+    within distance d have at least one chunk within d // 4 of each other, so
+    only the buckets around each chunk of the query need to be checked.
+    """
+
+    CHUNKS = 4
+    CHUNK_BITS = 16
+
+    def __init__(self):
+        self.items: dict[int, list[int]] = {}
+        self.tables: list[dict[int, set[int]]] = [{} for _ in range(self.CHUNKS)]
+
+    def chunks(self, value: int):
+        mask = (1 << self.CHUNK_BITS) - 1
+        for n in range(self.CHUNKS):
+            yield n, (value >> (n * self.CHUNK_BITS)) & mask
+
+    def add(self, value: int, item: int):
+        if value not in self.items:
+            self.items[value] = []
+            for n, chunk in self.chunks(value):
+                self.tables[n].setdefault(chunk, set()).add(value)
+        self.items[value].append(item)
+
+    def remove(self, value: int, item: int):
+        if item not in (items := self.items.get(value, [])):
+            return
+        items.remove(item)
+        if not items:
+            del self.items[value]
+            for n, chunk in self.chunks(value):
+                bucket = self.tables[n][chunk]
+                bucket.discard(value)
+                if not bucket:
+                    del self.tables[n][chunk]
+
+    def search(self, value: int, max_distance: int) -> list[tuple[int, int]]:
+        """Returns (distance, item) pairs within max_distance of value"""
+        candidates = set()
+        masks = chunk_masks(max_distance // self.CHUNKS)
+        for n, chunk in self.chunks(value):
+            table = self.tables[n]
+            for mask in masks:
+                if bucket := table.get(chunk ^ mask):
+                    candidates |= bucket
+        results = []
+        for candidate in candidates:
+            if (distance := (value ^ candidate).bit_count()) <= max_distance:
+                results.extend((distance, item) for item in self.items[candidate])
+        results.sort()
+        return results
+
+    def __len__(self):
+        return sum(len(items) for items in self.items.values())
+
+    def __iter__(self):
+        for value, items in self.items.items():
+            for item in items:
+                yield value, item
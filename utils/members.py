@@ -0,0 +1,81 @@
+import asyncio
+import discord
+import time
+
+from collections import OrderedDict
+from typing import Optional
+
+# Most user ids a gateway member query accepts
+QUERY_SIZE = 100
+
+
+class MemberResolver:
+    """Resolves member ids of a guild with as few gateway requests as possible.
+
+    The member cache is tried first, the remaining ids are requested in member
+    queries of up to 100 ids. Results, including ids that aren't members, are
+    remembered for ttl seconds so a reduced member cache stays cheap. At most
+    max_size results are kept, the least recently used are dropped first.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_size: int = 50000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.results: OrderedDict[
+            tuple[int, int], tuple[float, Optional[discord.Member]]
+        ] = OrderedDict()
+
+    def remember(self, guild_id: int, user_id: int, member: Optional[discord.Member]):
+        self.results[(guild_id, user_id)] = (time.monotonic() + self.ttl, member)
+        self.results.move_to_end((guild_id, user_id))
+        while len(self.results) > self.max_size:
+            self.results.popitem(last=False)
+
+    def forget(self, guild_id: int, user_id: int):
+        self.results.pop((guild_id, user_id), None)
+
+    def cached(self, guild: discord.Guild, user_id: int):
+        """Member of the cache or a remembered result, raises KeyError if unknown"""
+        if (member := guild.get_member(user_id)) is not None:
+            return member
+        expires, member = self.results[(guild.id, user_id)]
+        if expires < time.monotonic():
+            del self.results[(guild.id, user_id)]
+            raise KeyError(user_id)
+        self.results.move_to_end((guild.id, user_id))
+        return member
+
+    async def resolve(
+        self, guild: discord.Guild, user_ids: list[int]
+    ) -> dict[int, Optional[discord.Member]]:
+        """Members of user_ids by id, None for ids that aren't members.
+
+        Ids are left out if a member query fails, so callers can tell apart
+        members that left from members that couldn't be checked.
+        """
+        resolved = {}
+        missing = []
+        for user_id in dict.fromkeys(user_ids):
+            try:
+                resolved[user_id] = self.cached(guild, user_id)
+            except KeyError:
+                missing.append(user_id)
+        for n in range(0, len(missing), QUERY_SIZE):
+            batch = missing[n : n + QUERY_SIZE]
+            try:
+                members = await guild.query_members(
+                    user_ids=batch, limit=len(batch), cache=True
+                )
+            except (asyncio.TimeoutError, discord.ClientException):
+                continue
+            found = {member.id: member for member in members}
+            for user_id in batch:
+                resolved[user_id] = found.get(user_id)
+                self.remember(guild.id, user_id, found.get(user_id))
+        return resolved
+
+    async def get(self, guild: discord.Guild, user_id: int) -> Optional[discord.Member]:
+        return (await self.resolve(guild, [user_id])).get(user_id)
+
+    def __len__(self):
+        return len(self.results)
@@ -0,0 +1,239 @@
+import threading
+
+from collections import OrderedDict
+from contextvars import ContextVar
+from pathlib import Path
+from sqlalchemy import Engine, inspect
+from sqlalchemy.ext.horizontal_shard import ShardedSession
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter
+from typing import Iterator, Optional
+from utils.database import (
+    Art,
+    Artist,
+    Base,
+    BlackList,
+    CommunityRole,
+    Giveaway,
+    GiveawayEntry,
+    GiveawayRole,
+    Guild,
+    Poll,
+    PollOption,
+    Voter,
+    create_art_search,
+    create_db_engine,
+    create_read_engine,
+    migrate,
+)
+
+# Guild the running task works on, used to route statements that don't name one
+current_guild: ContextVar[Optional[int]] = ContextVar("current_guild", default=None)
+
+# Columns holding the guild id of a row
+GUILD_COLUMNS = {
+    ("guilds", "id"),
+    ("artist", "guild"),
+    ("blacklist", "guild"),
+    ("community_roles", "guild"),
+    ("polls", "guild_id"),
+    ("giveaway", "guild_id"),
+}
+GUILD_ATTRIBUTES = {
+    Guild: "id",
+    Artist: "guild",
+    BlackList: "guild",
+    CommunityRole: "guild",
+    Poll: "guild_id",
+    Giveaway: "guild_id",
+}
+PARENT_ATTRIBUTES = {
+    Art: "artist",
+    Voter: "poll",
+    PollOption: "poll",
+    GiveawayEntry: "giveaway",
+    GiveawayRole: "giveaway",
+}
+
+
+def use_guild(guild_id: Optional[int]):
+    """Routes the statements of the running task that don't name a guild"""
+    current_guild.set(guild_id)
+
+
+def guild_of(instance) -> Optional[int]:
+    """Guild of a mapped object, from its own columns or its parent"""
+    state = inspect(instance)
+    if state.key is not None:
+        return state.key[2]
+    if state.identity_token is not None:
+        return state.identity_token
+    cls = type(instance)
+    if cls in GUILD_ATTRIBUTES:
+        return getattr(instance, GUILD_ATTRIBUTES[cls])
+    if cls in PARENT_ATTRIBUTES and (
+        parent := getattr(instance, PARENT_ATTRIBUTES[cls])
+    ):
+        return guild_of(parent)
+    return None
+
+
+def guild_criteria(statement, parameters: Optional[dict] = None) -> list[int]:
+    """Guild ids a statement compares a guild column against"""
+    parameters = parameters or {}
+    guild_ids = []
+    for element in visitors.iterate(statement):
+        if not isinstance(element, BinaryExpression):
+            continue
+        column, value = element.left, element.right
+        if (
+            getattr(column, "table", None) is None
+            or (column.table.name, column.name) not in GUILD_COLUMNS
+            or not isinstance(value, BindParameter)
+        ):
+            continue
+        # Session.get passes the primary key as parameters
+        value = parameters.get(value.key, value.effective_value)
+        if value is None:
+            continue
+        if element.operator is operators.eq:
+            guild_ids.append(value)
+        elif element.operator is operators.in_op:
+            guild_ids.extend(value)
+    return guild_ids
+
+
+class GuildRouter:
+    """Keeps a SQLite database per guild in a directory.
+
+    Engines are opened on first use and the least recently used ones are
+    disposed once more than max_open are open, along with their readers.
+    """
+
+    def __init__(self, directory: str, max_open: int = 16, pool: Optional[dict] = None):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_open = max_open
+        self.pool = pool or {}
+        self.engines: OrderedDict[int, Engine] = OrderedDict()
+        self.readers: dict[int, Engine] = {}
+        self.created: set[int] = set()
+        self.lock = threading.Lock()
+
+    def path(self, guild_id: int) -> Path:
+        return self.directory / f"{guild_id}.db"
+
+    def guild_ids(self) -> list[int]:
+        return [int(path.stem) for path in self.directory.glob("*.db")]
+
+    def engine(self, guild_id: int) -> Engine:
+        with self.lock:
+            if (engine := self.engines.get(guild_id)) is not None:
+                self.engines.move_to_end(guild_id)
+                return engine
+            engine = create_db_engine(
+                {
+                    "database_url": f"sqlite:///{self.path(guild_id)}",
+                    "database_pool": self.pool,
+                }
+            )
+            if guild_id not in self.created:
+                Base.metadata.create_all(engine)
+                migrate(engine)
+                create_art_search(engine)
+                self.created.add(guild_id)
+            self.engines[guild_id] = engine
+            self.evict()
+            return engine
+
+    def reader(self, guild_id: int) -> Engine:
+        engine = self.engine(guild_id)
+        with self.lock:
+            if (reader := self.readers.get(guild_id)) is None:
+                reader = self.readers[guild_id] = create_read_engine({}, engine)
+            return reader
+
+    def evict(self):
+        # Engines with connections in use are kept until a later eviction, the
+        # engine just opened is last and never evicted
+        for guild_id, engine in list(self.engines.items())[:-1]:
+            if len(self.engines) <= self.max_open:
+                break
+            reader = self.readers.get(guild_id)
+            if engine.pool.checkedout() == 0 and (
+                reader is None or reader.pool.checkedout() == 0
+            ):
+                del self.engines[guild_id]
+                engine.dispose()
+                if reader is not None:
+                    del self.readers[guild_id]
+                    reader.dispose()
+
+    def all_engines(self) -> Iterator[Engine]:
+        for guild_id in self.guild_ids():
+            yield self.engine(guild_id)
+
+    def dispose(self):
+        with self.lock:
+            for engine in [*self.engines.values(), *self.readers.values()]:
+                engine.dispose()
+            self.engines.clear()
+            self.readers.clear()
+
+
+class GuildSession(ShardedSession):
+    """Session routing every row to the database of its guild.
+
+    Statements go to the guilds they compare a guild column against, then to
+    the guild of the object they load from, then to the current guild of the
+    task, and to every guild otherwise.
+    """
+
+    def __init__(self, router: GuildRouter, **kwargs):
+        super().__init__(
+            shard_chooser=self.choose_shard,
+            identity_chooser=self.choose_identity,
+            execute_chooser=self.choose_execute,
+            **kwargs,
+        )
+        self.router = router
+
+    def get_bind(self, mapper=None, *, shard_id=None, instance=None, clause=None, **kw):
+        if shard_id is None:
+            shard_id = self._choose_shard_and_assign(
+                mapper, instance=instance, clause=clause
+            )
+        return self.router.engine(shard_id)
+
+    def choose_shard(self, mapper, instance, clause=None) -> int:
+        if instance is not None and (guild_id := guild_of(instance)) is not None:
+            return guild_id
+        if clause is not None and (guild_ids := guild_criteria(clause)):
+            return guild_ids[0]
+        if (guild_id := current_guild.get()) is not None:
+            return guild_id
+        raise RuntimeError(f"No guild to route {instance or clause} to")
+
+    def choose_identity(
+        self, mapper, primary_key, *, lazy_loaded_from, execution_options, **kw
+    ) -> list[int]:
+        if lazy_loaded_from is not None:
+            return [lazy_loaded_from.identity_token]
+        if mapper.class_ is Guild:
+            return [primary_key[0]]
+        if mapper.class_ in (BlackList, CommunityRole):
+            return [primary_key[1]]
+        if (guild_id := current_guild.get()) is not None:
+            return [guild_id]
+        return self.router.guild_ids()
+
+    def choose_execute(self, orm_context) -> list[int]:
+        if orm_context.lazy_loaded_from is not None:
+            return [orm_context.lazy_loaded_from.identity_token]
+        if guild_ids := guild_criteria(orm_context.statement, orm_context.parameters):
+            return guild_ids
+        if orm_context.execution_options.get("all_guilds"):
+            return self.router.guild_ids()
+        if (guild_id := current_guild.get()) is not None:
+            return [guild_id]
+        return self.router.guild_ids()
@@ -0,0 +1,29 @@
+from sqlalchemy import bindparam, func, select
+from utils.database import Art, Artist, Poll, Voter
+
+# Statements of the hot paths, built once so their cache key is computed a
+# single time and the compiled SQL is reused, only the parameters change
+
+artist_by_member = select(Artist).where(
+    Artist.userid == bindparam("userid"), Artist.guild == bindparam("guild")
+)
+
+art_in_guild = (
+    select(Art)
+    .join(Art.artist)
+    .where(Art.id == bindparam("art_id"), Artist.guild == bindparam("guild"))
+)
+
+poll_in_guild = select(Poll).where(
+    Poll.id == bindparam("poll_id"), Poll.guild_id == bindparam("guild")
+)
+
+votes_per_option = (
+    select(Voter.option_id, func.count())
+    .where(Voter.poll_id == bindparam("poll_id"))
+    .group_by(Voter.option_id)
+)
+
+poll_ballots = select(Voter.ballot).where(
+    Voter.poll_id == bindparam("poll_id"), Voter.ballot.isnot(None)
+)
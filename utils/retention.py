@@ -0,0 +1,156 @@
+import gzip
+import json
+import os
+
+from datetime import datetime
+from sqlalchemy import Engine, delete, select, text
+from sqlalchemy.orm import Session
+from typing import Callable, Optional
+from utils.database import (
+    GiveawayEntry,
+    GiveawayResult,
+    PollResult,
+    Voter,
+)
+
+BATCH_SIZE = 500
+
+
+def prune_history(
+    engine: Engine,
+    before: datetime,
+    archive_dir: Optional[str] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+) -> tuple[int, int]:
+    """Deletes the voters and raffle entries of polls and raffles closed before
+    a date, appending them to a gzipped NDJSON file in archive_dir if given.
+
+    Only polls and raffles with a stored result are pruned, the result keeps
+    what info and list show. Rows are moved in keyset batches, each in its own
+    transaction, and progress is called with the running counts after each.
+    """
+    voters = entries = 0
+    fp = None
+    if archive_dir:
+        os.makedirs(archive_dir, exist_ok=True)
+        fp = gzip.open(
+            os.path.join(
+                archive_dir, f"history-{datetime.now():%Y%m%d%H%M%S}.ndjson.gz"
+            ),
+            "wt",
+            encoding="utf-8",
+        )
+    try:
+        with Session(engine) as s:
+            poll_ids = s.scalars(
+                select(PollResult.poll_id).where(PollResult.closed_at < before)
+            ).all()
+            for poll_id in poll_ids:
+                last_id = -1
+                while rows := s.execute(
+                    select(Voter.userid, Voter.option_id, Voter.ballot)
+                    .where(Voter.poll_id == poll_id, Voter.userid > last_id)
+                    .order_by(Voter.userid)
+                    .limit(BATCH_SIZE)
+                ).all():
+                    if fp:
+                        for userid, option_id, ballot in rows:
+                            entry = {
+                                "type": "voter",
+                                "poll_id": poll_id,
+                                "userid": userid,
+                                "option_id": option_id,
+                                "ballot": ballot.hex() if ballot else None,
+                            }
+                            fp.write(json.dumps(entry) + "\n")
+                    s.execute(
+                        delete(Voter).where(
+                            Voter.poll_id == poll_id,
+                            Voter.userid > last_id,
+                            Voter.userid <= rows[-1].userid,
+                        )
+                    )
+                    s.commit()
+                    last_id = rows[-1].userid
+                    voters += len(rows)
+                    if progress:
+                        progress(voters, entries)
+
+            giveaway_ids = s.scalars(
+                select(GiveawayResult.giveaway_id).where(
+                    GiveawayResult.closed_at < before
+                )
+            ).all()
+            for giveaway_id in giveaway_ids:
+                last_id = -1
+                while rows := s.execute(
+                    select(GiveawayEntry.user_id, GiveawayEntry.winner)
+                    .where(
+                        GiveawayEntry.giveaway_id == giveaway_id,
+                        GiveawayEntry.user_id > last_id,
+                    )
+                    .order_by(GiveawayEntry.user_id)
+                    .limit(BATCH_SIZE)
+                ).all():
+                    if fp:
+                        for user_id, winner in rows:
+                            entry = {
+                                "type": "entry",
+                                "giveaway_id": giveaway_id,
+                                "user_id": user_id,
+                                "winner": winner,
+                            }
+                            fp.write(json.dumps(entry) + "\n")
+                    s.execute(
+                        delete(GiveawayEntry).where(
+                            GiveawayEntry.giveaway_id == giveaway_id,
+                            GiveawayEntry.user_id > last_id,
+                            GiveawayEntry.user_id <= rows[-1].user_id,
+                        )
+                    )
+                    s.commit()
+                    last_id = rows[-1].user_id
+                    entries += len(rows)
+                    if progress:
+                        progress(voters, entries)
+    finally:
+        if fp:
+            fp.close()
+    return voters, entries
+
+
+def enable_incremental_vacuum(engine: Engine) -> bool:
+    """Switches a SQLite database to incremental auto_vacuum, so compact can
+    release its free pages.
+
+    The switch needs a full VACUUM, which rewrites the database holding the
+    write lock, so it is only done at startup before the bot connects. Returns
+    whether the database was switched.
+    """
+    if engine.dialect.name != "sqlite":
+        return False
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        # 2 is incremental
+        if conn.execute(text("PRAGMA auto_vacuum")).scalar() == 2:
+            return False
+        conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+        conn.execute(text("VACUUM"))
+        return True
+
+
+def compact(engine: Engine) -> int:
+    """Returns the free pages of a SQLite database to the filesystem.
+
+    Only databases using incremental auto_vacuum are compacted, see
+    enable_incremental_vacuum. Returns the number of pages released.
+    """
+    if engine.dialect.name != "sqlite":
+        return 0
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if conn.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+            return 0
+        free = conn.execute(text("PRAGMA freelist_count")).scalar()
+        # The sqlite3 module steps a pragma once, freeing a single page,
+        # executescript runs it to completion
+        conn.connection.driver_connection.executescript("PRAGMA incremental_vacuum;")
+        return free - conn.execute(text("PRAGMA freelist_count")).scalar()
@@ -0,0 +1,71 @@
+from sqlalchemy import Engine, delete, func, insert, select, update
+from sqlalchemy.orm import Session
+from typing import Optional
+from utils.database import Art, Artist, ArtistActivity
+
+BATCH_SIZE = 500
+
+
+def month_of(column, dialect: str):
+    """YYYY-MM of a timestamp column"""
+    if dialect == "postgresql":
+        return func.to_char(column, "YYYY-MM")
+    return func.strftime("%Y-%m", column)
+
+
+def refresh_gallery_stats(engine: Engine, guild_id: Optional[int] = None):
+    """Recomputes the artist counters and the monthly activity rollup of a
+    guild, or of every guild.
+
+    Artists are rewritten per guild in batches of BATCH_SIZE, each in its own
+    short transaction, so the bot's writes only wait for a single batch.
+    """
+    art = Art.__table__
+    month = month_of(art.c.created_at, engine.dialect.name)
+    with Session(engine) as s:
+        if guild_id is None:
+            guilds = s.scalars(select(Artist.guild).distinct()).all()
+        else:
+            guilds = [guild_id]
+        for guild in guilds:
+            last_id = -1
+            while ids := s.scalars(
+                select(Artist.id)
+                .where(Artist.guild == guild, Artist.id > last_id)
+                .order_by(Artist.id)
+                .limit(BATCH_SIZE)
+            ).all():
+                last_id = ids[-1]
+                batch = (
+                    select(Artist.id)
+                    .where(Artist.guild == guild, Artist.id.between(ids[0], last_id))
+                    .scalar_subquery()
+                )
+                s.execute(
+                    update(Artist)
+                    .where(Artist.id.in_(batch))
+                    .values(
+                        art_count=select(func.count())
+                        .where(art.c.artist_id == Artist.id)
+                        .scalar_subquery(),
+                        first_upload=select(func.min(art.c.created_at))
+                        .where(art.c.artist_id == Artist.id)
+                        .scalar_subquery(),
+                        last_upload=select(func.max(art.c.created_at))
+                        .where(art.c.artist_id == Artist.id)
+                        .scalar_subquery(),
+                    )
+                    .execution_options(synchronize_session=False)
+                )
+                s.execute(
+                    delete(ArtistActivity).where(ArtistActivity.artist_id.in_(batch))
+                )
+                s.execute(
+                    insert(ArtistActivity).from_select(
+                        ["artist_id", "month", "count"],
+                        select(art.c.artist_id, month, func.count())
+                        .where(art.c.artist_id.in_(batch), art.c.created_at.isnot(None))
+                        .group_by(art.c.artist_id, month),
+                    )
+                )
+                s.commit()
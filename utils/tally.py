@@ -0,0 +1,49 @@
+import numpy as np
+
+# Filler for the unused slots of a ballot
+UNRANKED = 255
+
+
+def encode_ballot(choices: list[int], n_options: int) -> bytes:
+    """Packs option positions into a fixed size ballot of one byte per option"""
+    return bytes(choices) + bytes([UNRANKED]) * (n_options - len(choices))
+
+
+def decode_ballot(ballot: bytes) -> list[int]:
+    return [choice for choice in ballot if choice != UNRANKED]
+
+
+def ballot_matrix(ballots: list[bytes], n_options: int) -> np.ndarray:
+    """Stacks ballots into a (voters, n_options) matrix"""
+    if not ballots:
+        return np.empty((0, n_options), dtype=np.uint8)
+    return np.frombuffer(b"".join(ballots), dtype=np.uint8).reshape(-1, n_options)
+
+
+def approval_tally(matrix: np.ndarray, n_options: int) -> np.ndarray:
+    return np.bincount(matrix[matrix != UNRANKED], minlength=n_options)
+
+
+def instant_runoff(matrix: np.ndarray, n_options: int) -> list[np.ndarray]:
+    """Counts ranked ballots with instant runoff voting.
+
+    Returns the first choice counts of every round. The option with the
+    fewest votes is eliminated each round until one has a majority.
+    """
+    rows = np.arange(len(matrix))
+    # Unranked slots index the trailing False so they are never usable
+    columns = np.minimum(matrix, n_options)
+    active = np.ones(n_options + 1, dtype=bool)
+    active[n_options] = False
+    rounds = []
+    while True:
+        usable = active[columns]
+        has_choice = usable.any(axis=1)
+        first = matrix[rows, usable.argmax(axis=1)][has_choice]
+        counts = np.bincount(first, minlength=n_options)[:n_options]
+        rounds.append(counts)
+        remaining = np.flatnonzero(active[:n_options])
+        total = counts.sum()
+        if total == 0 or len(remaining) <= 1 or counts.max() * 2 > total:
+            return rounds
+        active[remaining[counts[remaining].argmin()]] = False
@@ -3,9 +3,12 @@ import random
 import re
 import traceback
 
-from datetime import datetime
+from datetime import datetime, timezone
 from discord import app_commands
 from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+
+CDN_HOSTS = ("cdn.discordapp.com", "media.discordapp.net")
 
 
 # thanks ihaveahax
@@ -17,6 +20,85 @@ def gen_color(seed) -> discord.Color:
     return discord.Color((c_r << 16) + (c_g << 8) + c_b)
 
 
+class RandomPool:
+    """Set of ids with O(1) add, remove and uniform random choice"""
+
+    def __init__(self):
+        self.items: list[int] = []
+        self.positions: dict[int, int] = {}
+        self.rng = random.Random()
+
+    def add(self, item: int):
+        if item not in self.positions:
+            self.positions[item] = len(self.items)
+            self.items.append(item)
+
+    def remove(self, item: int):
+        if (position := self.positions.pop(item, None)) is None:
+            return
+        last = self.items.pop()
+        if position < len(self.items):
+            self.items[position] = last
+            self.positions[last] = position
+
+    def choice(self) -> Optional[int]:
+        return self.rng.choice(self.items) if self.items else None
+
+    def __len__(self):
+        return len(self.items)
+
+
+class PrefixTrie:
+    """Strings looked up by case insensitive prefix"""
+
+    def __init__(self):
+        # Each node maps a character to its child, the None key holds the
+        # strings ending at the node
+        self.root: dict = {}
+
+    def add(self, key: str):
+        node = self.root
+        for char in key.lower():
+            node = node.setdefault(char, {})
+        node.setdefault(None, set()).add(key)
+
+    def remove(self, key: str):
+        chars = key.lower()
+        path = [self.root]
+        for char in chars:
+            if (node := path[-1].get(char)) is None:
+                return
+            path.append(node)
+        if (ending := path[-1].get(None)) is None or key not in ending:
+            return
+        ending.remove(key)
+        if not ending:
+            del path[-1][None]
+        # Drop the nodes left without strings below them
+        for depth in range(len(chars), 0, -1):
+            if path[depth]:
+                break
+            del path[depth - 1][chars[depth - 1]]
+
+    def search(self, prefix: str, limit: int = 25) -> list[str]:
+        """Strings starting with prefix in alphabetical order, at most limit"""
+        node = self.root
+        for char in prefix.lower():
+            if (node := node.get(char)) is None:
+                return []
+        found = []
+        stack = [node]
+        while stack and len(found) < limit:
+            node = stack.pop()
+            found.extend(sorted(node.get(None, ())))
+            stack.extend(
+                node[char]
+                for char in sorted(node, key=str, reverse=True)
+                if char is not None
+            )
+        return found[:limit]
+
+
 class ConfirmationButtons(discord.ui.View):
     def __init__(self):
         super().__init__(timeout=30)
@@ -70,6 +152,32 @@ def parse_time(time_string) -> int:
     return sum(int(item[:-1]) * units[item[-1]] for item in match)
 
 
+def is_cdn_url(url: str) -> bool:
+    parts = urlsplit(url)
+    return parts.scheme == "https" and parts.hostname in CDN_HOSTS
+
+
+def parse_cdn_expiry(url: str) -> Optional[datetime]:
+    """Gets the expiration date of a signed Discord CDN url"""
+    parts = urlsplit(url)
+    if parts.hostname not in CDN_HOSTS:
+        return None
+    try:
+        expiry = int(parse_qs(parts.query)["ex"][0], 16)
+    except (KeyError, ValueError):
+        return None
+    return datetime.fromtimestamp(expiry, timezone.utc)
+
+
+async def refresh_cdn_urls(http: discord.http.HTTPClient, urls: list[str]):
+    """Gets fresh signed urls for up to 50 Discord CDN urls"""
+    data = await http.request(
+        discord.http.Route("POST", "/attachments/refresh-urls"),
+        json={"attachment_urls": urls},
+    )
+    return {entry["original"]: entry["refreshed"] for entry in data["refreshed_urls"]}
+
+
 def parse_date(date_string: str) -> Optional[datetime]:
     date_lst = date_string.split(" ")
 
@@ -81,7 +189,7 @@ def parse_date(date_string: str) -> Optional[datetime]:
         datetime_obj = datetime.strptime(" ".join(date_lst), "%Y-%m-%d %H:%M")
     except ValueError:
         return None
-    return datetime_obj
+    return datetime_obj.replace(tzinfo=timezone.utc)
 
 
 class TimeTransformer(app_commands.Transformer):
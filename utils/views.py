@@ -4,8 +4,12 @@ import discord
 
 from typing import Optional, TYPE_CHECKING
 from utils.checks import not_new, not_blacklisted
+from utils.partitions import use_guild
+from utils.tally import decode_ballot
 
 if TYPE_CHECKING:
+    from cogs.community import RoleEntry
+    from utils.database import Poll
     from utils.managers import VoteManager, RaffleManager
 
 
@@ -16,13 +20,133 @@ class VoteButton(discord.ui.Button["VoteView"]):
         self,
         custom_id: str,
         label: str,
+        option: int,
         style: discord.ButtonStyle = discord.ButtonStyle.secondary,
     ):
         super().__init__(style=style, label=label, custom_id=custom_id)
+        self.option = option
 
     async def callback(self, interaction: discord.Interaction):
         assert self.view is not None
-        await self.view.manager.process_vote(interaction, option=self.label)
+        await self.view.manager.process_vote(
+            interaction, custom_id=self.view.custom_id, option=self.option
+        )
+
+
+class BallotButton(discord.ui.Button["VoteView"]):
+    def __init__(self, custom_id: str):
+        super().__init__(
+            style=discord.ButtonStyle.primary, label="Vote", custom_id=custom_id
+        )
+
+    async def callback(self, interaction: discord.Interaction):
+        assert self.view is not None
+        assert isinstance(interaction.user, discord.Member)
+        manager = self.view.manager
+        if (poll := manager.get_ongoing_poll(self.view.custom_id)) is None:
+            return
+        voter = manager.get_voter(interaction.user, poll)
+        current = decode_ballot(voter.ballot) if voter and voter.ballot else []
+        view = BallotView(manager, poll, current)
+        await interaction.response.send_message(
+            view.describe(), view=view, ephemeral=True
+        )
+
+
+class ApprovalSelect(discord.ui.Select["BallotView"]):
+    def __init__(self, options: list[str], current: list[int]):
+        super().__init__(
+            placeholder="Pick every option you approve of",
+            min_values=0,
+            max_values=len(options),
+            options=[
+                discord.SelectOption(label=label, value=str(n), default=n in current)
+                for n, label in enumerate(options)
+            ],
+        )
+
+    async def callback(self, interaction: discord.Interaction):
+        assert self.view is not None
+        await self.view.submit(interaction, [int(value) for value in self.values])
+
+
+class RankButton(discord.ui.Button["BallotView"]):
+    def __init__(self, label: str, option: int):
+        super().__init__(style=discord.ButtonStyle.secondary, label=label)
+        self.option = option
+
+    async def callback(self, interaction: discord.Interaction):
+        assert self.view is not None
+        self.view.ranking.append(self.option)
+        self.disabled = True
+        await interaction.response.edit_message(
+            content=self.view.describe(), view=self.view
+        )
+
+
+class BallotView(discord.ui.View):
+    """Ephemeral view to fill an approval or ranked ballot"""
+
+    def __init__(self, poll_manager: VoteManager, poll: Poll, current: list[int]):
+        super().__init__(timeout=300)
+        self.manager = poll_manager
+        self.poll = poll
+        self.labels = poll.parsed_options
+        self.ranking: list[int] = []
+        self.current = current
+        if poll.mode == "approval":
+            self.add_item(ApprovalSelect(self.labels, current))
+        else:
+            for n, label in enumerate(self.labels):
+                self.add_item(RankButton(label, n))
+            submit = discord.ui.Button(label="Submit", style=discord.ButtonStyle.green)
+            submit.callback = self.submit_ranking
+            self.add_item(submit)
+            reset = discord.ui.Button(label="Reset", style=discord.ButtonStyle.red)
+            reset.callback = self.reset_ranking
+            self.add_item(reset)
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        use_guild(interaction.guild_id)
+        return True
+
+    def describe(self) -> str:
+        if self.poll.mode == "approval":
+            return "Pick every option you approve of."
+        msg = "Click the options in order of preference, then submit."
+        if self.ranking:
+            msg += "\n" + " > ".join(self.labels[n] for n in self.ranking)
+        elif self.current:
+            msg += "\nCurrent vote: " + " > ".join(self.labels[n] for n in self.current)
+        return msg
+
+    async def submit(self, interaction: discord.Interaction, choices: list[int]):
+        assert isinstance(interaction.user, discord.Member)
+        if not self.manager.ongoing_poll(self.poll.custom_id):
+            return
+        self.manager.save_ballot(interaction.user, self.poll, choices)
+        if self.poll.mode == "approval":
+            content = "Approved: " + (
+                ", ".join(self.labels[n] for n in choices) or "nothing"
+            )
+        else:
+            content = "Voted: " + " > ".join(self.labels[n] for n in choices)
+        await interaction.response.edit_message(content=content, view=None)
+        self.stop()
+
+    async def submit_ranking(self, interaction: discord.Interaction):
+        if not self.ranking:
+            return await interaction.response.send_message(
+                "Rank at least one option.", ephemeral=True
+            )
+        await self.submit(interaction, self.ranking)
+
+    async def reset_ranking(self, interaction: discord.Interaction):
+        self.ranking = []
+        for item in self.children:
+            if isinstance(item, RankButton):
+                item.disabled = False
+        await interaction.response.edit_message(content=self.describe(), view=self)
 
 
 class LinkButton(discord.ui.Button):
@@ -67,6 +191,7 @@ class VoteView(BasePersistentView):
         message_id: Optional[int] = None,
         *,
         options: list[str],
+        mode: Optional[str] = "single",
     ):
         super().__init__(
             custom_id=custom_id,
@@ -74,15 +199,20 @@ class VoteView(BasePersistentView):
             manager=poll_manager,
             message_id=message_id,
         )
-        for n, option in enumerate(options):
-            self.add_item(VoteButton(label=option, custom_id=f"{custom_id}_{n}"))
+        if mode in ("approval", "ranked"):
+            self.add_item(BallotButton(custom_id=f"{custom_id}_ballot"))
+        else:
+            for n, option in enumerate(options):
+                self.add_item(
+                    VoteButton(label=option, custom_id=f"{custom_id}_{n}", option=n)
+                )
 
     async def interaction_check(self, interaction: discord.Interaction):
-        assert interaction.guild is not None
+        use_guild(interaction.guild_id)
         return (
             not_new(interaction)
             and not_blacklisted(interaction)
-            and self.manager.ongoing_poll(interaction.guild.id)
+            and self.manager.ongoing_poll(self.custom_id)
         )
 
 
@@ -97,7 +227,7 @@ class RaffleButton(discord.ui.Button["RaffleView"]):
 
     async def callback(self, interaction: discord.Interaction):
         assert self.view is not None
-        await self.view.manager.process_entry(interaction)
+        await self.view.manager.process_entry(interaction, self.view.custom_id)
 
 
 class RaffleView(BasePersistentView):
@@ -117,11 +247,92 @@ class RaffleView(BasePersistentView):
         self.add_item(RaffleButton(label="Join", custom_id=f"{custom_id}_join"))
 
     async def interaction_check(self, interaction: discord.Interaction):
-        assert interaction.guild is not None
+        use_guild(interaction.guild_id)
         if not_new(interaction) and not_blacklisted(interaction):
-            if not self.manager.get_raffle(interaction.guild.id):
+            if not self.manager.get_raffle(self.custom_id):
                 await interaction.response.send_message(
                     "There is no ongoing raffle", ephemeral=True
                 )
                 return False
         return True
+
+
+class CommunityRoleSelect(discord.ui.Select["CommunityRoleView"]):
+    def __init__(self, entries: list[RoleEntry], current: set[int]):
+        super().__init__(
+            placeholder="Pick your community roles",
+            min_values=0,
+            max_values=len(entries),
+            options=[
+                discord.SelectOption(
+                    label=entry.alias[:100],
+                    description=entry.description[:100] or None,
+                    value=str(entry.id),
+                    default=entry.id in current,
+                )
+                for entry in entries
+            ],
+        )
+        self.chosen = {entry.id for entry in entries if entry.id in current}
+
+    async def callback(self, interaction: discord.Interaction):
+        # Picks are applied together when saved
+        self.chosen = {int(value) for value in self.values}
+        await interaction.response.defer()
+
+
+class CommunityRoleView(discord.ui.View):
+    """Ephemeral view to pick several community roles and apply them at once"""
+
+    # A row is left for the save button
+    max_selects = 4
+
+    def __init__(self, entries: list[RoleEntry], member: discord.Member):
+        super().__init__(timeout=300)
+        self.entries = entries[: self.max_selects * 25]
+        current = {role.id for role in member.roles}
+        self.selects = [
+            CommunityRoleSelect(self.entries[n : n + 25], current)
+            for n in range(0, len(self.entries), 25)
+        ]
+        for select in self.selects:
+            self.add_item(select)
+        save = discord.ui.Button(label="Save", style=discord.ButtonStyle.green)
+        save.callback = self.save
+        self.add_item(save)
+
+    async def save(self, interaction: discord.Interaction):
+        assert isinstance(interaction.user, discord.Member)
+        assert interaction.guild is not None
+        # The member of this interaction has the latest roles
+        member = interaction.user
+        community = {entry.id for entry in self.entries}
+        chosen = set().union(*(select.chosen for select in self.selects))
+        current = {role.id for role in member.roles}
+        added = chosen - current
+        removed = (current & community) - chosen
+        if not added and not removed:
+            return await interaction.response.edit_message(
+                content="Your community roles are unchanged.", view=None
+            )
+        roles = [
+            role
+            for role in member.roles
+            if not role.is_default() and role.id not in removed
+        ]
+        roles.extend(
+            role
+            for role_id in added
+            if (role := interaction.guild.get_role(role_id)) is not None
+        )
+        try:
+            await member.edit(roles=roles, reason="Community roles")
+        except discord.Forbidden:
+            return await interaction.response.edit_message(
+                content="I can't change your roles.", view=None
+            )
+        await interaction.response.edit_message(
+            content=f"Added {len(added)} and removed {len(removed)} community role(s).",
+            view=None,
+        )
+        self.stop()